@@ -1,18 +1,33 @@
 import time
-from flask import Flask, request, jsonify, send_file, redirect
+from flask import Flask, Response, g, request, jsonify, send_file, redirect, stream_with_context, make_response
 from flask_cors import CORS
 from datetime import datetime as dt, timedelta, timezone 
 import jwt
 from functools import wraps
+from collections import OrderedDict
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-import io
+import os
+import sys
+import base64
 import re 
-
-# --- MongoDB and GridFS Imports ---
-from pymongo import MongoClient, DESCENDING, ASCENDING
-from gridfs import GridFS
-from bson import ObjectId
+import json
+import queue
+import hashlib
+import shutil
+import stat
+import tempfile
+import threading
+import zipfile
+import zlib
+import contextvars
+import tracemalloc
+
+# --- MongoDB Imports ---
+from pymongo import MongoClient, DESCENDING, ASCENDING, ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from bson import ObjectId, Binary, json_util
 # --- End of Imports ---
 
 
@@ -20,6 +35,71 @@ app = Flask(__name__)
 CORS(app)  # This enables Cross-Origin Resource Sharing
 app.config['SECRET_KEY'] = 'your-super-secret-key-that-should-be-in-an-env-file'
 
+# --- Resumable Upload Settings ---
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # Max bytes accepted per PUT
+app.config['UPLOAD_MAX_SIZE'] = 2 * 1024 * 1024 * 1024  # Max total file size
+app.config['UPLOAD_SESSION_TTL'] = timedelta(hours=24)  # Idle time before a session is abandoned
+
+# --- MongoDB Settings ---
+# Point MONGO_URI at a replica set (e.g. 'mongodb://localhost:27017/?replicaSet=rs0')
+# to let read-heavy dashboard routes use secondaries.
+app.config['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+app.config['MONGO_READ_PREFERENCE'] = os.environ.get('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+app.config['MONGO_MAX_STALENESS_SECONDS'] = int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', 90))  # Server minimum is 90
+
+# --- File Storage Settings ---
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'gridfs')  # Backend for new files: 'gridfs' or 'local'
+app.config['STORAGE_LOCAL_ROOT'] = os.environ.get(
+    'STORAGE_LOCAL_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
+)
+# When set (e.g. '/protected-files/'), local files are served by a front proxy via
+# X-Accel-Redirect instead of by Flask. The proxy location must map to STORAGE_LOCAL_ROOT.
+app.config['STORAGE_ACCEL_REDIRECT_PREFIX'] = os.environ.get('STORAGE_ACCEL_REDIRECT_PREFIX')
+# Permissions of stored local files. The proxy's user must be able to read them:
+# 0644 by default, or 0640 when the proxy shares the app's group.
+app.config['STORAGE_LOCAL_FILE_MODE'] = int(os.environ.get('STORAGE_LOCAL_FILE_MODE', '0644'), 8)
+app.config['STORAGE_CHUNK_SIZE'] = 255 * 1024  # GridFS default chunk size
+# Larger chunks for big media files mean fewer chunk documents per download.
+# The first matching content type prefix wins; everything else uses STORAGE_CHUNK_SIZE.
+app.config['STORAGE_CHUNK_SIZES'] = {
+    'video/': 4 * 1024 * 1024,
+    'audio/': 1024 * 1024,
+    'application/zip': 1024 * 1024,
+}
+# Files up to this size are kept inside their fs.files document and read in one query; 0 disables
+app.config['STORAGE_INLINE_MAX_SIZE'] = int(os.environ.get('STORAGE_INLINE_MAX_SIZE', 16 * 1024))
+# Compressible uploads are gzipped at rest; set STORAGE_COMPRESSION='' to store everything raw
+app.config['STORAGE_COMPRESSION'] = os.environ.get('STORAGE_COMPRESSION', 'gzip') == 'gzip'
+app.config['STORAGE_COMPRESSION_LEVEL'] = 6
+app.config['STORAGE_COMPRESSION_SAMPLE_SIZE'] = 64 * 1024  # Bytes test-compressed before deciding
+app.config['STORAGE_COMPRESSION_MIN_SIZE'] = 1024  # Smaller files are not worth the gzip overhead
+app.config['STORAGE_COMPRESSION_MAX_RATIO'] = 0.9  # Sample must shrink to at most this fraction
+
+# --- Users Response Cache Settings ---
+# 'memory' caches per process. With several workers use 'disk' so a write in any
+# worker invalidates every worker's entries. An empty value disables the cache.
+app.config['USERS_CACHE_BACKEND'] = os.environ.get('USERS_CACHE_BACKEND', 'memory')
+# Must be private to the app's user: the disk cache refuses a directory owned by
+# anyone else and makes it 0700.
+app.config['USERS_CACHE_DIR'] = os.environ.get(
+    'USERS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'users')
+)
+app.config['USERS_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+# Writes through the app invalidate entries immediately; the TTL bounds staleness
+# from writes made outside the app (e.g. in mongosh).
+app.config['USERS_CACHE_TTL_SECONDS'] = app.config['MONGO_MAX_STALENESS_SECONDS']
+
+# --- Request Profiling Settings ---
+app.config['PROFILE_SAMPLE_INTERVAL'] = 0.005  # Seconds between stack samples
+app.config['PROFILE_TOP_ALLOCATIONS'] = 25  # Allocation sites kept from the tracemalloc snapshot
+app.config['PROFILE_TTL'] = timedelta(days=7)  # Stored profiles expire after this
+app.config['PROFILE_ARM_TTL'] = timedelta(hours=1)  # Armed profiles that never match expire after this
+app.config['PROFILE_ARM_POLL_SECONDS'] = 5  # How often each process re-reads the armed profiles
+
+# --- Live Event Settings ---
+app.config['EVENTS_HEARTBEAT_SECONDS'] = 15  # Keep-alive comment interval on idle streams
+app.config['EVENTS_STREAM_MAX_SECONDS'] = 300  # Clients reconnect (and re-authenticate) after this
+
 # --- Constants ---
 ERROR_MSG_18_PLUS = "User must be at least 18 years old."
 ERROR_MSG_EMAIL_EXISTS = "This email address is already registered."
@@ -27,23 +107,833 @@ ERROR_MSG_ADMIN_REQUIRED = "Admin access required"
 ERROR_MSG_USER_NOT_FOUND = "User not found"
 # --- End of Constants ---
 
+# --- User Repository ---
+#
+# All writes to the users collection go through here. Updates use
+# find_one_and_update so the new document comes back in the same round trip,
+# and email uniqueness is enforced by a unique index: callers catch
+# DuplicateKeyError instead of running a find_one check before writing. If the
+# index cannot be built (e.g. duplicates already exist), the repository falls back
+# to checking before each write that sets an email.
+
+class UserRepository:
+    """Write-path data access for the users collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.email_index_ready = False
+
+    def ensure_indexes(self):
+        try:
+            self.collection.create_index([("email", ASCENDING)], unique=True)
+        except PyMongoError as e:
+            print(f"Could not create unique email index. Are there duplicate emails? \n{e}")
+        self.email_index_ready = any(
+            index.get('unique') and index['key'] == [("email", 1)]
+            for index in self.collection.index_information().values()
+        )
+        if not self.email_index_ready:
+            print("WARNING: No unique email index. Emails are checked before each write "
+                  "until duplicates are removed and the backend is restarted.")
+
+    def _check_email_available(self, email, user_filter=None):
+        """Fallback for a missing unique index. Raises DuplicateKeyError if email is taken."""
+        if self.email_index_ready or not email:
+            return
+        email_query = {"email": email}
+        if user_filter:
+            email_query = {"$and": [email_query, {"$nor": [user_filter]}]}
+        if self.collection.find_one(email_query, {"_id": 1}):
+            raise DuplicateKeyError(ERROR_MSG_EMAIL_EXISTS, 11000)
+
+    def create(self, new_user):
+        """Inserts a user and returns it with its _id. Raises DuplicateKeyError on a taken email."""
+        self._check_email_available(new_user.get('email'))
+        result = self.collection.insert_one(new_user)
+        new_user['_id'] = result.inserted_id
+        _invalidate_users_cache()
+        _publish_user_change(new_user['_id'], new_user)
+        return new_user
+
+    def update(self, user_filter, update):
+        """Applies an update and returns the updated user, or None if nothing matched."""
+        self._check_email_available((update.get('$set') or {}).get('email'), user_filter)
+        updated_user = self.collection.find_one_and_update(
+            user_filter, update, return_document=ReturnDocument.AFTER
+        )
+        if updated_user:
+            _invalidate_users_cache()
+            _publish_user_change(updated_user['_id'], updated_user)
+        return updated_user
+
+    def set_fields(self, user_id, fields):
+        return self.update({"_id": ObjectId(user_id)}, {"$set": fields})
+
+    def push_gallery_files(self, user_id, file_objs):
+        return self.update({"_id": ObjectId(user_id)}, {"$push": {"gallery": {"$each": file_objs}}})
+
+    def pull_gallery_file(self, file_id):
+        """Removes a file from whichever gallery holds it. Returns that user or None."""
+        return self.update({"gallery.id": file_id}, {"$pull": {"gallery": {"id": file_id}}})
+
+    def delete(self, user_id):
+        """Deletes a user and returns the deleted document, or None."""
+        deleted_user = self.collection.find_one_and_delete({"_id": ObjectId(user_id)})
+        if deleted_user:
+            _invalidate_users_cache()
+            _publish_user_deleted(user_id)
+        return deleted_user
+# --- End Repository ---
+
+# --- File Storage ---
+#
+# Every stored file has a GridFS-style catalogue document in 'fs.files' (filename,
+# contentType, length, chunkSize, uploadDate). metadata.backend records where the
+# bytes live; documents without it are plain GridFS files. Gallery entries and
+# profile_pic_id keep pointing at the catalogue _id, so files can move between
+# backends without touching user documents.
+#
+# Compressible files are stored gzipped: metadata.encoding is 'gzip', 'length' is
+# the stored size and metadata.original_length the size of the upload itself.
+#
+# Small files skip the backends altogether and keep their bytes in the catalogue
+# document's 'data' field, so reading one is a single query.
+
+# Content types that are already compressed and gain nothing from deflate
+PRECOMPRESSED_CONTENT_TYPES = (
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'video/', 'audio/',
+    'application/zip', 'application/gzip', 'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/vnd.openxmlformats-officedocument.',
+)
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # zlib settings for a gzip container
+
+def _is_precompressed(content_type):
+    """Checks if a content type is already compressed."""
+    return (content_type or '').lower().startswith(PRECOMPRESSED_CONTENT_TYPES)
+
+class _ChunkReader:
+    """Read-only file object over an iterable of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer.extend(next(self._chunks))
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        pass
+
+def _iter_stream(stream, chunk_size, head=b""):
+    """Yields head and then the rest of stream in chunk_size pieces."""
+    if head:
+        yield head
+    data = stream.read(chunk_size)
+    while data:
+        yield data
+        data = stream.read(chunk_size)
+
+def _gzip_chunks(chunks, counter):
+    """Yields the gzip-compressed form of chunks, adding the raw size to counter['length']."""
+    compressor = zlib.compressobj(app.config['STORAGE_COMPRESSION_LEVEL'], zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        counter['length'] += len(chunk)
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _gunzip_chunks(chunks):
+    """Yields the decompressed form of gzip chunks without ever inflating more than one chunk at a time."""
+    max_length = app.config['STORAGE_CHUNK_SIZE']
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk, max_length)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, max_length)
+    data = decompressor.flush()
+    if data:
+        yield data
+
+def _should_compress(content_type, sample):
+    """Decides from a leading sample of the upload if it is worth storing gzipped."""
+    if not app.config['STORAGE_COMPRESSION'] or _is_precompressed(content_type):
+        return False
+    if len(sample) < app.config['STORAGE_COMPRESSION_MIN_SIZE']:
+        return False
+    compressed = zlib.compress(sample, 1)
+    return len(compressed) <= len(sample) * app.config['STORAGE_COMPRESSION_MAX_RATIO']
+
+def _chunk_size_for(content_type):
+    content_type = (content_type or '').lower()
+    for prefix, chunk_size in app.config['STORAGE_CHUNK_SIZES'].items():
+        if content_type.startswith(prefix):
+            return chunk_size
+    return app.config['STORAGE_CHUNK_SIZE']
+
+def _send_chunks(file_doc, chunks, as_attachment, length):
+    """Streams chunks as a download of file_doc."""
+    response = send_file(
+        _ChunkReader(chunks),
+        mimetype=file_doc.get('contentType') or 'application/octet-stream',
+        as_attachment=as_attachment,
+        download_name=file_doc.get('filename'),
+        conditional=False,
+        etag=False
+    )
+    response.content_length = length
+    return response
+
+def _read_full(stream, size):
+    """Reads exactly size bytes from stream unless it ends first."""
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+class GridFSStorage:
+    """Keeps file bytes in 'fs.chunks', readable by any GridFS client."""
+
+    name = 'gridfs'
+
+    def __init__(self, database):
+        self.chunks = database['fs.chunks']
+
+    def ensure_indexes(self):
+        self.chunks.create_index([("files_id", ASCENDING), ("n", ASCENDING)], unique=True)
+
+    def write(self, file_id, stream, chunk_size):
+        """Writes stream as chunks of file_id and returns the number of bytes written."""
+        length = 0
+        try:
+            n = 0
+            data = _read_full(stream, chunk_size)
+            while data:
+                self.chunks.insert_one({"files_id": file_id, "n": n, "data": Binary(data)})
+                length += len(data)
+                n += 1
+                data = _read_full(stream, chunk_size)
+        except Exception:
+            self.remove({"_id": file_id})
+            raise
+        return length
+
+    def iter_chunks(self, file_doc, database):
+        for chunk in database['fs.chunks'].find({"files_id": file_doc['_id']}).sort("n", ASCENDING):
+            yield chunk['data']
+
+    def send(self, file_doc, database, as_attachment):
+        return _send_chunks(file_doc, self.iter_chunks(file_doc, database), as_attachment, file_doc['length'])
+
+    def remove(self, file_doc):
+        self.chunks.delete_many({"files_id": file_doc['_id']})
+
+class LocalFileStorage:
+    """Keeps file bytes on the local filesystem so downloads can use sendfile."""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def relative_path(self, file_id):
+        file_id = str(file_id)
+        return os.path.join(file_id[-2:], file_id)
+
+    def path(self, file_id):
+        return os.path.join(self.root, self.relative_path(file_id))
+
+    def write(self, file_id, stream, chunk_size):
+        """Writes stream to the file's path atomically and returns its size."""
+        path = self.path(file_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(stream, out, chunk_size)
+            os.chmod(temp_path, app.config['STORAGE_LOCAL_FILE_MODE'])  # mkstemp creates files as 0600
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return os.path.getsize(path)
+
+    def iter_chunks(self, file_doc, database):
+        with open(self.path(file_doc['_id']), 'rb') as f:
+            chunk = f.read(file_doc.get('chunkSize') or app.config['STORAGE_CHUNK_SIZE'])
+            while chunk:
+                yield chunk
+                chunk = f.read(file_doc.get('chunkSize') or app.config['STORAGE_CHUNK_SIZE'])
+
+    def send(self, file_doc, database, as_attachment):
+        mimetype = file_doc.get('contentType') or 'application/octet-stream'
+        prefix = app.config['STORAGE_ACCEL_REDIRECT_PREFIX']
+        # nginx drops Content-Encoding across an X-Accel redirect, so gzip-stored
+        # files are always sent by Flask, which sets that header itself
+        if prefix and not (file_doc.get('metadata') or {}).get('encoding'):
+            # The front proxy streams the file itself; Flask only sends headers
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + self.relative_path(file_doc['_id']).replace(os.sep, '/')
+            disposition = 'attachment' if as_attachment else 'inline'
+            response.headers['Content-Disposition'] = f'{disposition}; filename="{file_doc.get("filename")}"'
+            return response
+
+        # Werkzeug hands real files to the server's wsgi.file_wrapper (sendfile)
+        return send_file(
+            self.path(file_doc['_id']),
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=file_doc.get('filename')
+        )
+
+    def remove(self, file_doc):
+        try:
+            os.remove(self.path(file_doc['_id']))
+        except FileNotFoundError:
+            pass
+
+class InlineStorage:
+    """Keeps small files in their catalogue document; store_file writes the 'data' field."""
+
+    name = 'inline'
+
+    def iter_chunks(self, file_doc, database):
+        if 'data' in file_doc:
+            yield file_doc['data']
+        else:
+            # Loaded without its bytes (e.g. by a batched query); fetch them now
+            yield database['fs.files'].find_one({"_id": file_doc['_id']}, {"data": 1})['data']
+
+    def send(self, file_doc, database, as_attachment):
+        return _send_chunks(file_doc, self.iter_chunks(file_doc, database), as_attachment, file_doc['length'])
+
+    def remove(self, file_doc):
+        pass  # The bytes go away with the catalogue document
+
+def _storage_for(file_doc):
+    return storage_backends[(file_doc.get('metadata') or {}).get('backend', GridFSStorage.name)]
+
+def store_file(stream, filename, content_type, backend_name=None):
+    """Stores a file in the configured backend and returns its id as a string."""
+    backend = storage_backends[backend_name or app.config['STORAGE_BACKEND']]
+    file_id = ObjectId()
+    chunk_size = _chunk_size_for(content_type)
+    inline_max_size = app.config['STORAGE_INLINE_MAX_SIZE']
+
+    head = _read_full(stream, max(app.config['STORAGE_COMPRESSION_SAMPLE_SIZE'], inline_max_size + 1))
+    if len(head) <= inline_max_size:
+        backend = storage_backends[InlineStorage.name]
+
+    chunks = _iter_stream(stream, chunk_size, head=head)
+    counter = None
+    if _should_compress(content_type, head):
+        counter = {"length": 0}
+        chunks = _gzip_chunks(chunks, counter)
+
+    inline_data = None
+    if backend.name == InlineStorage.name:
+        inline_data = b"".join(chunks)
+        length = len(inline_data)
+    else:
+        length = backend.write(file_id, _ChunkReader(chunks), chunk_size)
+
+    metadata = {}
+    if backend.name != GridFSStorage.name:
+        metadata['backend'] = backend.name
+    if counter is not None:
+        metadata['encoding'] = 'gzip'
+        metadata['original_length'] = counter['length']
+
+    file_doc = {
+        "_id": file_id,
+        "filename": filename,
+        "contentType": content_type,
+        "length": length,
+        "chunkSize": chunk_size,
+        "uploadDate": dt.now(timezone.utc),
+    }
+    if metadata:
+        file_doc['metadata'] = metadata
+    if inline_data is not None:
+        file_doc['data'] = Binary(inline_data)
+    try:
+        file_catalog.insert_one(file_doc)
+    except Exception:
+        backend.remove(file_doc)
+        raise
+    return str(file_id)
+
+def find_stored_file(file_id, database=None):
+    """Returns the catalogue document for a file id, or None."""
+    database = database if database is not None else db
+    return database['fs.files'].find_one({"_id": ObjectId(file_id)})
+
+def stored_file_size(file_doc):
+    """Returns the size of the file as uploaded, before any compression."""
+    return (file_doc.get('metadata') or {}).get('original_length', file_doc['length'])
+
+def iter_stored_file(file_doc, database=None):
+    """Yields the file's original bytes, decompressing them if needed."""
+    chunks = _storage_for(file_doc).iter_chunks(file_doc, database if database is not None else db)
+    if (file_doc.get('metadata') or {}).get('encoding') == 'gzip':
+        return _gunzip_chunks(chunks)
+    return chunks
+
+def send_stored_file(file_doc, database=None, as_attachment=True):
+    """Builds the download response for a file."""
+    database = database if database is not None else db
+    backend = _storage_for(file_doc)
+    encoding = (file_doc.get('metadata') or {}).get('encoding')
+    if not encoding:
+        return backend.send(file_doc, database, as_attachment)
+
+    if request.accept_encodings.quality(encoding) > 0:
+        # Hand over the stored bytes as they are and let the client decompress them
+        response = backend.send(file_doc, database, as_attachment)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = _send_chunks(file_doc, iter_stored_file(file_doc, database), as_attachment, stored_file_size(file_doc))
+    response.vary.add('Accept-Encoding')
+    return response
+
+def delete_stored_file(file_id):
+    """Deletes a file's bytes and its catalogue document."""
+    file_doc = file_catalog.find_one_and_delete({"_id": ObjectId(file_id)})
+    if file_doc:
+        _storage_for(file_doc).remove(file_doc)
+# --- End File Storage ---
+
+# --- Request Profiling ---
+#
+# An admin can profile a single request by sending 'X-Profile: 1' (or adding
+# '?profile=1'). token_required then runs the view under a stack sampler and
+# tracemalloc, and records the Mongo commands it issues. The result is saved in
+# 'profiles' and its id is returned in the X-Profile-Id header. Without the flag
+# the only cost is the flag check and a context variable lookup per Mongo command.
+
+_profiled_commands = contextvars.ContextVar('profiled_commands', default=None)
+_profile_lock = threading.Lock()  # tracemalloc is process-wide, so one profile at a time
+
+# Command fields worth keeping; documents and update bodies are left out
+PROFILED_COMMAND_FIELDS = ('filter', 'sort', 'projection', 'pipeline', 'skip', 'limit', 'hint')
+
+class _ProfileCommandListener(monitoring.CommandListener):
+    """Records the Mongo commands issued while a profiled request is running."""
+
+    def started(self, event):
+        commands = _profiled_commands.get()
+        if commands is None:
+            return
+        collection = event.command.get(event.command_name)
+        command = {
+            "command": event.command_name,
+            "database": event.database_name,
+            "collection": collection if isinstance(collection, str) else None,
+        }
+        for field in PROFILED_COMMAND_FIELDS:
+            if field in event.command:
+                command[field] = json_util.dumps(event.command[field])[:1000]
+        commands[event.request_id] = command
+
+    def succeeded(self, event):
+        self._finish(event, True)
+
+    def failed(self, event):
+        self._finish(event, False)
+
+    def _finish(self, event, ok):
+        commands = _profiled_commands.get()
+        if commands is not None and event.request_id in commands:
+            commands[event.request_id].update(duration_ms=event.duration_micros / 1000, ok=ok)
+
+class _StackSampler:
+    """Samples one thread's stack from a background thread and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.samples += 1
+
+    def collapsed(self):
+        """Returns the samples in collapsed-stack format (one 'a;b;c count' line per stack)."""
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.counts.items()))
+
+def _profile_requested():
+    return request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+# Profiles armed by an admin for another user's request or a path. They are stored
+# in 'profile_arms' so every worker sees them; each process keeps a copy that is
+# re-read at most every PROFILE_ARM_POLL_SECONDS, so a request never queries Mongo
+# just to find out that nothing is armed.
+_profile_arms = {"arms": [], "loaded_at": None}
+
+def _reload_profile_arms():
+    _profile_arms['loaded_at'] = None
+
+def _match_profile_arm(current_user):
+    """Returns the first armed profile that matches this request, or None."""
+    now = time.monotonic()
+    loaded_at = _profile_arms['loaded_at']
+    if loaded_at is None or now - loaded_at >= app.config['PROFILE_ARM_POLL_SECONDS']:
+        try:
+            arms = list(profile_arms_collection.find({"expires_at": {"$gt": dt.now(timezone.utc)}}))
+        except Exception as e:
+            print(f"Error loading armed profiles: {e}")
+            arms = []
+        _profile_arms.update(arms=arms, loaded_at=now)
+
+    user_id = str(current_user['_id'])
+    for arm in _profile_arms['arms']:
+        if arm.get('user_id') and arm['user_id'] != user_id:
+            continue
+        if arm.get('path') and arm['path'] != request.path:
+            continue
+        return arm
+    return None
+
+def _claim_profile_arm(arm):
+    """Removes an armed profile so only one request, in any process, is profiled for it."""
+    _profile_arms['arms'] = [a for a in _profile_arms['arms'] if a['_id'] != arm['_id']]
+    try:
+        return profile_arms_collection.find_one_and_delete({"_id": arm['_id']}) is not None
+    except Exception as e:
+        print(f"Error claiming armed profile: {e}")
+        return False
+
+def _top_allocations(snapshot):
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size": stat.size,
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics('lineno')[:app.config['PROFILE_TOP_ALLOCATIONS']]
+    ]
+
+def _run_profiled(f, current_user, arm, *args, **kwargs):
+    """
+    Runs a view under the profilers and stores what they saw in 'profiles'.
+    Streamed bodies (ZIP downloads, event streams) are produced after the view
+    returns and are not part of the profile.
+
+    'arm' is the armed profile being captured, or None for an admin's own
+    X-Profile request. An armed request is never refused: if the profiler is busy
+    or another process claimed the arm first, it simply runs unprofiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        if arm is not None:
+            return f(current_user, *args, **kwargs)
+        return jsonify({"message": "Another request is being profiled"}), 409
+    try:
+        if arm is not None and not _claim_profile_arm(arm):
+            return f(current_user, *args, **kwargs)
+        sampler = _StackSampler(threading.get_ident(), app.config['PROFILE_SAMPLE_INTERVAL'])
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        commands = {}
+        token = _profiled_commands.set(commands)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        finally:
+            duration = time.perf_counter() - started
+            sampler.stop()
+            _profiled_commands.reset(token)
+            snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+        profile = {
+            "method": request.method,
+            "path": request.path,
+            "query_string": request.query_string.decode(errors='replace'),
+            "user_id": str(current_user['_id']),
+            "status_code": response.status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "sample_interval_ms": app.config['PROFILE_SAMPLE_INTERVAL'] * 1000,
+            "samples": sampler.samples,
+            "collapsed": sampler.collapsed(),
+            "peak_memory": peak_memory,
+            "allocations": _top_allocations(snapshot),
+            "mongo_commands": list(commands.values()),
+            "created_date": dt.now(timezone.utc),
+        }
+        if arm is not None:
+            profile['arm_id'] = str(arm['_id'])
+            profile['armed_by'] = arm['armed_by']
+        try:
+            profile_id = str(profiles_collection.insert_one(profile).inserted_id)
+            # Only the admin who asked gets the id back; armed profiles are found
+            # through GET /admin/profiles instead.
+            if arm is None:
+                response.headers['X-Profile-Id'] = profile_id
+        except Exception as e:
+            print(f"Error saving request profile: {e}")
+        return response
+    finally:
+        _profile_lock.release()
+# --- End Request Profiling ---
+
+# --- Users Response Cache ---
+#
+# Caches the JSON bodies of GET /users. Every write in UserRepository moves the
+# cache to a new generation, and an entry is only stored if the generation did not
+# change while its response was being built, so a write never leaves a stale entry
+# behind. Misses are read from the primary: a page read from a lagging secondary
+# right after a write would otherwise be cached as current.
+
+class _MemoryResponseCache:
+    """Per-process LRU of response bodies, bounded by their total size."""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry[0] != generation or entry[1] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, generation, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            old = self._entries.pop(key, None)
+            if old:
+                self._size -= len(old[2])
+            self._entries[key] = (generation, time.monotonic() + self.ttl, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted[2])
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._size = 0
+
+class _DiskResponseCache:
+    """
+    Response bodies as files in a directory shared by every worker on the host.
+    The generation is a random token in a file that is replaced atomically, and
+    it is part of each entry's file name, so old entries are simply never found.
+    """
+
+    def __init__(self, root, max_bytes, ttl):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        # Cached bodies hold user details, and anyone who can write here can plant
+        # responses, so the directory must be a real directory owned by this user.
+        st = os.lstat(root)
+        if not stat.S_ISDIR(st.st_mode):
+            raise PermissionError(f"Users cache directory {root} is not a directory")
+        if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+            raise PermissionError(f"Users cache directory {root} is owned by another user")
+        if stat.S_IMODE(st.st_mode) != 0o700:
+            os.chmod(root, 0o700)
+        if not os.path.exists(os.path.join(root, 'generation')):
+            self.invalidate()
+
+    def _write(self, path, data):
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def _entry_path(self, key, generation):
+        return os.path.join(self.root, hashlib.sha256(f"{generation}:{key}".encode()).hexdigest() + '.cache')
+
+    def generation(self):
+        try:
+            with open(os.path.join(self.root, 'generation')) as f:
+                return f.read()
+        except FileNotFoundError:
+            return self.invalidate()
+
+    def get(self, key, generation):
+        path = self._entry_path(key, generation)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, generation, body):
+        if len(body) > self.max_bytes:
+            return
+        self._write(self._entry_path(key, generation), body)
+        self._prune()
+
+    def invalidate(self):
+        generation = os.urandom(16).hex()
+        self._write(os.path.join(self.root, 'generation'), generation.encode())
+        return generation
+
+    def _prune(self):
+        """Removes the oldest entries until the directory fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.cache'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+                except FileNotFoundError:
+                    pass  # Pruned by another worker
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def _make_users_cache():
+    backend = app.config['USERS_CACHE_BACKEND']
+    max_bytes = app.config['USERS_CACHE_MAX_BYTES']
+    ttl = app.config['USERS_CACHE_TTL_SECONDS']
+    if backend == 'disk':
+        try:
+            return _DiskResponseCache(app.config['USERS_CACHE_DIR'], max_bytes, ttl)
+        except OSError as e:
+            print(f"Error: users cache disabled: {e}")
+            return None
+    if backend == 'memory':
+        return _MemoryResponseCache(max_bytes, ttl)
+    return None
+
+users_cache = _make_users_cache()
+
+def _invalidate_users_cache():
+    if users_cache is None:
+        return
+    try:
+        users_cache.invalidate()
+    except OSError as e:
+        print(f"Error invalidating users cache: {e}")
+# --- End Users Response Cache ---
+
 # --- MongoDB Connection ---
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+def _dashboard_read_preference():
+    """Builds the read preference used by staleness-tolerant read routes."""
+    mode = READ_PREFERENCES.get(app.config['MONGO_READ_PREFERENCE'], Primary)
+    if mode is Primary:
+        return Primary()
+    return mode(max_staleness=app.config['MONGO_MAX_STALENESS_SECONDS'])
+
 try:
-    client = MongoClient('mongodb://localhost:27017/', serverSelectionTimeoutMS=5000)
+    client = MongoClient(
+        app.config['MONGO_URI'],
+        serverSelectionTimeoutMS=5000,
+        event_listeners=[_ProfileCommandListener()]
+    )
     client.server_info()
     db = client['user_auth_db']
     user_collection = db['users']
-    fs = GridFS(db)
+    user_repository = UserRepository(user_collection)
+    user_repository.ensure_indexes()
+    file_catalog = db['fs.files']
+    storage_backends = {
+        GridFSStorage.name: GridFSStorage(db),
+        LocalFileStorage.name: LocalFileStorage(app.config['STORAGE_LOCAL_ROOT']),
+        InlineStorage.name: InlineStorage(),
+    }
+    storage_backends[GridFSStorage.name].ensure_indexes()
+    # Read-routed handles: only for list/search/download reads that tolerate staleness.
+    # Auth, writes and read-after-write paths keep using the primary handles above.
+    read_db = db.with_options(read_preference=_dashboard_read_preference())
+    read_user_collection = read_db['users']
+    upload_sessions = db['upload_sessions']
+    upload_parts = db['upload_parts']
+    upload_parts.create_index([("upload_id", ASCENDING), ("offset", ASCENDING)], unique=True)
+    profiles_collection = db['profiles']
+    profiles_collection.create_index("created_date", expireAfterSeconds=int(app.config['PROFILE_TTL'].total_seconds()))
+    profile_arms_collection = db['profile_arms']
+    profile_arms_collection.create_index("expires_at", expireAfterSeconds=0)
     print("Connected to MongoDB!")
 except Exception as e:
     print(f"Error: Could not connect to MongoDB. Is it running? \n{e}")
 # --- End of DB Connection ---
 
 # --- Helper Function to Serialize MongoDB Docs ---
-def serialize_user(user, include_email=True):
+def serialize_user(user, include_email=True, include_gallery=True):
     """
     Serializes a MongoDB user document into a JSON-friendly format.
-    Includes all fields from the registration and user forms.
+    Includes all fields from the registration and user forms. Dashboard lists
+    leave out the gallery array and page through /users/<id>/files instead.
     """
     if not user:
         return None
@@ -58,9 +948,12 @@ def serialize_user(user, include_email=True):
         "selected_date": user.get('selected_date'),
         "agreed_to_terms": user.get('agreed_to_terms'),
         "email_notifications": user.get('email_notifications'),
-        "gallery": user.get('gallery', [])
+        "gallery_count": len(user.get('gallery', []))
     }
 
+    if include_gallery:
+        user_data['gallery'] = user.get('gallery', [])
+
     if include_email:
         user_data['email'] = user.get('email')
 
@@ -165,10 +1058,159 @@ def token_required(f):
         except Exception as e:
             return jsonify({"message": "Token is invalid", "error": str(e)}), 401
 
+        g.current_user = current_user
+        if _profile_requested() and is_admin(current_user):
+            return _run_profiled(f, current_user, None, *args, **kwargs)
+        arm = _match_profile_arm(current_user)
+        if arm is not None:
+            return _run_profiled(f, current_user, arm, *args, **kwargs)
         return f(current_user, *args, **kwargs)
     return decorated
 # --- END of Decorator ---
 
+
+# --- Read Routing Helpers ---
+#
+# A staff member who just wrote something must see it on their next read, but a
+# secondary may lag by up to MONGO_MAX_STALENESS_SECONDS. Users with a successful
+# write inside that window are kept on the primary. This is tracked per process.
+_recent_writers = {}
+
+def _mark_recent_writer(user_id):
+    now = time.monotonic()
+    window = app.config['MONGO_MAX_STALENESS_SECONDS']
+    if len(_recent_writers) > 1000:
+        for writer_id, written_at in list(_recent_writers.items()):
+            if now - written_at > window:
+                _recent_writers.pop(writer_id, None)
+    _recent_writers[str(user_id)] = now
+
+@app.after_request
+def _track_recent_writer(response):
+    current_user = g.get('current_user')
+    if current_user and request.method != 'GET' and response.status_code < 400:
+        _mark_recent_writer(current_user['_id'])
+    return response
+
+def _wrote_recently(current_user):
+    written_at = _recent_writers.get(str(current_user['_id']))
+    return written_at is not None and time.monotonic() - written_at <= app.config['MONGO_MAX_STALENESS_SECONDS']
+
+def _users_for_read(current_user):
+    """Returns the users collection handle to use for a staleness-tolerant read."""
+    return user_collection if _wrote_recently(current_user) else read_user_collection
+
+def _db_for_read(current_user):
+    """Returns the database handle to use for staleness-tolerant file reads."""
+    return db if _wrote_recently(current_user) else read_db
+# --- End Helpers ---
+
+
+# --- Live Event Bus ---
+#
+# Open dashboards subscribe to user change events over /events. When MongoDB
+# supports change streams (replica sets), a watcher thread feeds the bus from the
+# users collection so changes made by any worker are seen. Otherwise the routes
+# publish their own changes, which only reaches subscribers in the same process.
+
+class _EventBus:
+    """Fans out change events to in-process subscriber queues."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=256)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop its backlog and ask it to refetch instead
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait({"type": "resync"})
+
+event_bus = _EventBus()
+_change_stream_state = {"active": False, "started": False}
+_change_stream_lock = threading.Lock()
+
+def _event_from_change(change):
+    """Converts a change stream document into a bus event (or None)."""
+    operation = change.get('operationType')
+    if operation == 'delete':
+        return {"type": "delete", "id": change['documentKey']['_id']}
+    if operation in ('insert', 'update', 'replace') and change.get('fullDocument'):
+        return {"type": "change", "id": change['documentKey']['_id'], "user": change['fullDocument']}
+    return None
+
+def _watch_user_changes(stream):
+    """Watcher thread: publishes user changes, resuming after transient errors."""
+    while True:
+        try:
+            with stream:
+                for change in stream:
+                    event = _event_from_change(change)
+                    if event:
+                        event_bus.publish(event)
+            # The stream ended without an error, e.g. on 'invalidate' after users was
+            # dropped or renamed. It cannot be iterated again, so fall back to the bus
+            # and have viewers refetch whatever they may have missed.
+            print("User change stream closed, using in-process events")
+            _change_stream_state['active'] = False
+            event_bus.publish({"type": "resync"})
+            return
+        except PyMongoError as e:
+            print(f"User change stream interrupted: {e}")
+            time.sleep(5)
+            try:
+                stream = user_collection.watch(full_document='updateLookup', resume_after=stream.resume_token)
+            except PyMongoError as e:
+                print(f"Could not reopen user change stream, using in-process events: {e}")
+                _change_stream_state['active'] = False
+                return
+
+def _ensure_change_stream():
+    """Starts the change stream watcher once, if the deployment supports it."""
+    with _change_stream_lock:
+        if _change_stream_state['started']:
+            return
+        _change_stream_state['started'] = True
+        try:
+            stream = user_collection.watch(full_document='updateLookup')
+        except PyMongoError as e:
+            print(f"Change streams unavailable, using in-process events: {e}")
+            return
+        _change_stream_state['active'] = True
+        threading.Thread(target=_watch_user_changes, args=(stream,), daemon=True).start()
+
+def _publish_user_change(user_id, user):
+    """Publishes a user change when there is no change stream to do it for us."""
+    if _change_stream_state['active'] or not event_bus.has_subscribers():
+        return
+    event_bus.publish({"type": "change", "id": ObjectId(user_id), "user": user})
+
+def _publish_user_deleted(user_id):
+    """Publishes a user deletion when there is no change stream to do it for us."""
+    if _change_stream_state['active'] or not event_bus.has_subscribers():
+        return
+    event_bus.publish({"type": "delete", "id": ObjectId(user_id)})
+# --- End Event Bus ---
+
 @app.route('/me', methods=['GET'])
 @token_required
 def get_me(current_user):
@@ -177,6 +1219,14 @@ def get_me(current_user):
 
 # --- Authentication Routes ---
 
+def _discard_stored_files(file_ids):
+    """Helper to remove files stored for a write that was then rejected."""
+    for file_id in file_ids:
+        try:
+            delete_stored_file(file_id)
+        except Exception as e:
+            print(f"  > Error deleting file {file_id}: {e}")
+
 @app.route('/register', methods=['POST'])
 def register():
     data = request.form
@@ -187,9 +1237,6 @@ def register():
     
     if selected_date and not is_over_18(selected_date):
         errors.append(ERROR_MSG_18_PLUS)
-        
-    if user_collection.find_one({"email": email}):
-        errors.append(ERROR_MSG_EMAIL_EXISTS)
     
     if errors:
         return jsonify({"message": "\n".join(errors)}), 400
@@ -203,8 +1250,7 @@ def register():
         file = request.files['profile_pic']
         if file.filename != '':
             filename = secure_filename(file.filename)
-            file_id = fs.put(file, filename=filename, content_type=file.mimetype)
-            profile_pic_id = str(file_id)
+            profile_pic_id = store_file(file, filename, file.mimetype)
 
     gallery_files = []
     if 'gallery' in request.files:
@@ -212,9 +1258,9 @@ def register():
         for file in files:
             if file.filename != '':
                 filename = secure_filename(file.filename)
-                file_id = fs.put(file, filename=filename, content_type=file.mimetype)
+                file_id = store_file(file, filename, file.mimetype)
                 gallery_files.append({
-                    "id": str(file_id),
+                    "id": file_id,
                     "filename": filename
                 })
 
@@ -233,8 +1279,14 @@ def register():
         "gallery": gallery_files
     }
     
-    result = user_collection.insert_one(new_user)
-    new_user_id = str(result.inserted_id)
+    try:
+        new_user_id = str(user_repository.create(new_user)['_id'])
+    except DuplicateKeyError:
+        _discard_stored_files([profile_pic_id] if profile_pic_id else [])
+        _discard_stored_files([file_obj['id'] for file_obj in gallery_files])
+        return jsonify({"message": ERROR_MSG_EMAIL_EXISTS}), 400
+    # Not behind token_required, so the after_request hook does not see this write
+    _mark_recent_writer(new_user_id)
 
     token = jwt.encode(
         {
@@ -287,13 +1339,11 @@ def get_profile_pic(user_id):
             initials = user.get('name', 'U')[0].upper()
             return redirect(f"https://placehold.co/150x150/E2D9FF/6842FF?text={initials}")
 
-        profile_pic_file = fs.get(ObjectId(user['profile_pic_id']))
+        profile_pic_file = find_stored_file(user['profile_pic_id'])
+        if not profile_pic_file:
+            return redirect("https://placehold.co/150x150/E2D9FF/6842FF?text=X")
         
-        return send_file(
-            io.BytesIO(profile_pic_file.read()),
-            mimetype=profile_pic_file.content_type,
-            as_attachment=False
-        )
+        return send_stored_file(profile_pic_file, as_attachment=False)
     except Exception as e:
         print(f"Error getting profile pic: {e}")
         return redirect("https://placehold.co/150x150/E2D9FF/6842FF?text=X")
@@ -305,9 +1355,11 @@ def get_profile_pic(user_id):
 @token_required
 def get_file(current_user, file_id):
     try:
-        file_to_download = fs.get(ObjectId(file_id))
+        file_to_download = find_stored_file(file_id, _db_for_read(current_user))
+        if not file_to_download:
+            return jsonify({"message": "File not found or invalid ID"}), 404
         
-        file_owner = user_collection.find_one({"gallery.id": file_id})
+        file_owner = _users_for_read(current_user).find_one({"gallery.id": file_id})
 
         is_staff = is_employee_or_admin(current_user)
         is_owner = file_owner and str(file_owner['_id']) == str(current_user['_id'])
@@ -315,17 +1367,111 @@ def get_file(current_user, file_id):
         if not is_staff and not is_owner:
             return jsonify({"message": "Access denied"}), 403
         
-        return send_file(
-            io.BytesIO(file_to_download.read()),
-            mimetype=file_to_download.content_type,
-            as_attachment=True,
-            download_name=file_to_download.filename
-        )
+        return send_stored_file(file_to_download, _db_for_read(current_user), as_attachment=True)
             
     except Exception as e:
         print(f"Error getting file: {e}")
         return jsonify({"message": "File not found or invalid ID"}), 404
 
+# --- Gallery ZIP Download ---
+#
+# The archive is written into a small in-memory buffer that is drained after
+# every stored chunk, so memory use stays constant regardless of gallery size.
+
+class _ZipStreamBuffer:
+    """Unseekable write target for zipfile that hands back what was written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def _unique_archive_name(filename, used_names):
+    """Helper to avoid duplicate member names inside one archive."""
+    name = filename or 'file'
+    base, dot, ext = name.rpartition('.')
+    if not dot:
+        base, ext = name, ''
+    counter = 1
+    while name in used_names:
+        counter += 1
+        name = f"{base} ({counter}).{ext}" if ext else f"{base} ({counter})"
+    used_names.add(name)
+    return name
+
+def _stream_gallery_zip(gallery, database):
+    """Generator that yields a ZIP archive of the given gallery entries."""
+    buffer = _ZipStreamBuffer()
+    used_names = set()
+
+    file_ids = [ObjectId(file_obj['id']) for file_obj in gallery]
+    # Inline bytes are left out here and fetched per member, so memory stays flat
+    file_docs = {str(doc['_id']): doc for doc in database['fs.files'].find({"_id": {"$in": file_ids}}, {"data": 0})}
+
+    with zipfile.ZipFile(buffer, mode='w') as archive:
+        for file_obj in gallery:
+            file_doc = file_docs.get(file_obj['id'])
+            if not file_doc:
+                print(f"  > Skipping missing file {file_obj['id']} in archive")
+                continue
+
+            info = zipfile.ZipInfo(
+                _unique_archive_name(file_obj.get('filename'), used_names),
+                date_time=file_doc['uploadDate'].timetuple()[:6]
+            )
+            info.compress_type = zipfile.ZIP_STORED if _is_precompressed(file_doc.get('contentType')) else zipfile.ZIP_DEFLATED
+            info.file_size = stored_file_size(file_doc)
+
+            with archive.open(info, mode='w') as member:
+                for chunk in iter_stored_file(file_doc, database):
+                    member.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+
+    yield buffer.drain()
+
+@app.route('/users/<string:user_id>/files.zip', methods=['GET'])
+@token_required
+def download_gallery_zip(current_user, user_id):
+    is_staff = is_employee_or_admin(current_user)
+    is_owner = str(current_user['_id']) == user_id
+
+    if not is_staff and not is_owner:
+        return jsonify({"message": "Access denied"}), 403
+
+    try:
+        user = _users_for_read(current_user).find_one({"_id": ObjectId(user_id)}, {"name": 1, "gallery": 1})
+    except Exception:
+        return jsonify({"message": "Invalid User ID"}), 400
+
+    if not user:
+        return jsonify({"message": ERROR_MSG_USER_NOT_FOUND}), 404
+
+    gallery = user.get('gallery', [])
+    selected_ids = [file_id for file_id in request.args.get('ids', '').split(',') if file_id]
+    if selected_ids:
+        gallery = [file_obj for file_obj in gallery if file_obj['id'] in selected_ids]
+
+    if not gallery:
+        return jsonify({"message": "No files to download"}), 404
+
+    archive_name = secure_filename(f"{user.get('name', 'user')}-files.zip") or "files.zip"
+    return Response(
+        _stream_gallery_zip(gallery, _db_for_read(current_user)),
+        mimetype='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}"'}
+    )
+
 @app.route('/upload', methods=['POST'])
 @token_required
 def upload_files(current_user):
@@ -344,28 +1490,357 @@ def upload_files(current_user):
     for file in files:
         if file.filename != '':
             filename = secure_filename(file.filename)
-            file_id = fs.put(file, filename=filename, content_type=file.mimetype)
+            file_id = store_file(file, filename, file.mimetype)
             file_obj = {
-                "id": str(file_id),
+                "id": file_id,
                 "filename": filename
             }
             uploaded_file_list.append(file_obj)
 
-    user_collection.update_one(
-        {"_id": current_user['_id']},
-        {"$push": {"gallery": {"$each": uploaded_file_list}}}
-    )
+    user_repository.push_gallery_files(current_user['_id'], uploaded_file_list)
     
     return jsonify({"message": f"Successfully uploaded {len(uploaded_file_list)} files."}), 201
 
+# --- Resumable Upload Routes ---
+#
+# Protocol: POST /uploads creates a session, PUT /uploads/<id>?offset=N appends
+# one chunk (with an 'X-Chunk-SHA256' header), GET /uploads/<id> reports the
+# current offset so a client can resume after a dropped connection, and
+# POST /uploads/<id>/complete assembles the parts into file storage.
+
+def _get_upload_session(upload_id, current_user):
+    """Helper to load a live upload session owned by current_user (or None)."""
+    try:
+        session = upload_sessions.find_one({"_id": ObjectId(upload_id), "user_id": current_user['_id']})
+    except Exception:
+        return None
+
+    if session and session['expires_at'] < dt.now(timezone.utc).replace(tzinfo=None):
+        _discard_upload_session(session['_id'])
+        return None
+    return session
+
+def _discard_upload_session(upload_id):
+    """Helper to delete an upload session and all of its staged parts."""
+    upload_parts.delete_many({"upload_id": upload_id})
+    upload_sessions.delete_one({"_id": upload_id})
+
+def _purge_expired_upload_sessions():
+    """Helper to clean up sessions abandoned for longer than UPLOAD_SESSION_TTL."""
+    now = dt.now(timezone.utc)
+    for session in upload_sessions.find({"expires_at": {"$lt": now}}, {"_id": 1}):
+        _discard_upload_session(session['_id'])
+
+def _iter_upload_parts(session):
+    """Yields a session's staged parts in order, checking there are no gaps."""
+    expected_offset = 0
+    for part in upload_parts.find({"upload_id": session['_id']}).sort("offset", ASCENDING):
+        if part['offset'] != expected_offset:
+            raise ValueError(f"missing bytes at offset {expected_offset}")
+        yield part['data']
+        expected_offset += part['length']
+    if expected_offset != session['size']:
+        raise ValueError(f"assembled {expected_offset} of {session['size']} bytes")
+
+def _serialize_upload_session(session):
+    return {
+        "upload_id": str(session['_id']),
+        "filename": session['filename'],
+        "size": session['size'],
+        "offset": session['offset'],
+        "chunk_size": app.config['UPLOAD_CHUNK_SIZE'],
+        # Naive UTC like every other timestamp, whether or not it came back from Mongo
+        "expires_at": _as_naive_utc(session['expires_at']).isoformat()
+    }
+
+@app.route('/uploads', methods=['POST'])
+@token_required
+def create_upload_session(current_user):
+    if current_user.get('role', 'user').lower() != 'user':
+        return jsonify({"message": "Only users can upload files"}), 403
+
+    data = request.json or {}
+    filename = secure_filename(data.get('filename', ''))
+    size = data.get('size')
+
+    if not filename:
+        return jsonify({"message": "A filename is required"}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({"message": "File size must be a positive integer"}), 400
+    if size > app.config['UPLOAD_MAX_SIZE']:
+        return jsonify({"message": "File is larger than the maximum upload size"}), 413
+
+    _purge_expired_upload_sessions()
+
+    now = dt.now(timezone.utc)
+    session = {
+        "user_id": current_user['_id'],
+        "filename": filename,
+        "content_type": data.get('content_type') or 'application/octet-stream',
+        "size": size,
+        "offset": 0,
+        "created_date": now,
+        "expires_at": now + app.config['UPLOAD_SESSION_TTL']
+    }
+    result = upload_sessions.insert_one(session)
+    session['_id'] = result.inserted_id
+
+    return jsonify(_serialize_upload_session(session)), 201
+
+@app.route('/uploads/<string:upload_id>', methods=['GET'])
+@token_required
+def get_upload_session(current_user, upload_id):
+    session = _get_upload_session(upload_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found or expired"}), 404
+    return jsonify(_serialize_upload_session(session)), 200
+
+@app.route('/uploads/<string:upload_id>', methods=['PUT'])
+@token_required
+def upload_chunk(current_user, upload_id):
+    session = _get_upload_session(upload_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found or expired"}), 404
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"message": "Query parameter 'offset' is required"}), 400
+
+    if offset != session['offset']:
+        return jsonify({"message": "Offset does not match the upload session", "offset": session['offset']}), 409
+
+    length = request.content_length
+    if not length:
+        return jsonify({"message": "Chunk body is empty"}), 400
+    if length > app.config['UPLOAD_CHUNK_SIZE']:
+        return jsonify({"message": "Chunk is larger than the maximum chunk size"}), 413
+    if offset + length > session['size']:
+        return jsonify({"message": "Chunk extends past the declared file size"}), 400
+
+    expected_checksum = request.headers.get('X-Chunk-SHA256', '').lower()
+    if not expected_checksum:
+        return jsonify({"message": "Header 'X-Chunk-SHA256' is required"}), 400
+
+    chunk = request.get_data(cache=False)
+    if len(chunk) != length:
+        return jsonify({"message": "Chunk body is incomplete", "offset": session['offset']}), 400
+    if hashlib.sha256(chunk).hexdigest() != expected_checksum:
+        return jsonify({"message": "Chunk checksum mismatch", "offset": session['offset']}), 422
+
+    try:
+        upload_parts.insert_one({
+            "upload_id": session['_id'],
+            "offset": offset,
+            "length": length,
+            "sha256": expected_checksum,
+            "data": Binary(chunk)
+        })
+    except DuplicateKeyError:
+        # A previous attempt may have stored the part but died before moving the
+        # offset. The same bytes are a safe retry; anything else is a conflict.
+        stored_part = upload_parts.find_one(
+            {"upload_id": session['_id'], "offset": offset}, {"sha256": 1, "length": 1}
+        )
+        if not stored_part or stored_part['sha256'] != expected_checksum or stored_part['length'] != length:
+            return jsonify({"message": "Chunk at this offset was already received"}), 409
+
+    upload_sessions.update_one(
+        {"_id": session['_id'], "offset": offset},
+        {"$set": {
+            "offset": offset + length,
+            "expires_at": dt.now(timezone.utc) + app.config['UPLOAD_SESSION_TTL']
+        }}
+    )
+
+    return jsonify({"upload_id": upload_id, "offset": offset + length}), 200
+
+@app.route('/uploads/<string:upload_id>', methods=['DELETE'])
+@token_required
+def cancel_upload_session(current_user, upload_id):
+    session = _get_upload_session(upload_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found or expired"}), 404
+
+    _discard_upload_session(session['_id'])
+    return jsonify({"message": "Upload cancelled"}), 200
+
+@app.route('/uploads/<string:upload_id>/complete', methods=['POST'])
+@token_required
+def complete_upload_session(current_user, upload_id):
+    session = _get_upload_session(upload_id, current_user)
+    if not session:
+        return jsonify({"message": "Upload session not found or expired"}), 404
+
+    if session['offset'] != session['size']:
+        return jsonify({"message": "Upload is not complete", "offset": session['offset']}), 409
+
+    try:
+        file_id = store_file(_ChunkReader(_iter_upload_parts(session)), session['filename'], session['content_type'])
+    except Exception as e:
+        print(f"Error assembling upload {upload_id}: {e}")
+        _discard_upload_session(session['_id'])
+        return jsonify({"message": "Upload could not be assembled. Please upload the file again."}), 500
+
+    file_obj = {
+        "id": file_id,
+        "filename": session['filename']
+    }
+    user_repository.push_gallery_files(current_user['_id'], [file_obj])
+    _discard_upload_session(session['_id'])
+
+    return jsonify({"message": "File uploaded successfully", "file": file_obj}), 201
+
+# --- Gallery Listing ---
+#
+# The gallery array only holds ids and filenames, so listings join the GridFS
+# 'fs.files' documents for those ids in one query. Sorting, filtering and keyset
+# (cursor) paging all happen in that query. 'size' is computed in the pipeline so
+# compressed files are listed, filtered and sorted by their original size.
+
+GALLERY_SORT_FIELDS = {
+    'name': 'filename',
+    'type': 'contentType',
+    'size': 'size',
+    'upload_date': 'uploadDate',
+}
+GALLERY_FIELDS = {
+    'id': '_id',
+    'filename': 'filename',
+    'content_type': 'contentType',
+    'size': 'size',
+    'upload_date': 'uploadDate',
+}
+GALLERY_DEFAULT_LIMIT = 50
+GALLERY_MAX_LIMIT = 200
+
+def _encode_gallery_cursor(file_doc, sort_field):
+    raw = json_util.dumps([file_doc.get(sort_field), file_doc['_id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_gallery_cursor(cursor):
+    """Returns (last_sort_value, last_id). Raises ValueError on a bad cursor."""
+    try:
+        last_value, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    return last_value, last_id
+
+def _add_gallery_filters(args, file_query):
+    """Adds name/type/size/date filters from request args to file_query."""
+    if args.get('name'):
+        file_query['filename'] = {"$regex": re.escape(args['name']), "$options": "i"}
+    if args.get('type'):
+        file_query['contentType'] = {"$regex": f"^{re.escape(args['type'])}", "$options": "i"}
+
+    size_query = {}
+    if args.get('min_size'):
+        size_query['$gte'] = int(args['min_size'])
+    if args.get('max_size'):
+        size_query['$lte'] = int(args['max_size'])
+    if size_query:
+        file_query['size'] = size_query
+
+    date_filters = []
+    _add_date_filter(args.get('uploaded_after', ''), args.get('uploaded_before', ''), date_filters)
+    if date_filters:
+        file_query['uploadDate'] = date_filters[0]['created_date']
+
+def _serialize_gallery_file(file_doc, gallery_names, fields):
+    file_data = {
+        "id": str(file_doc['_id']),
+        "filename": gallery_names.get(str(file_doc['_id']), file_doc.get('filename')),
+        "content_type": file_doc.get('contentType'),
+        "size": file_doc.get('size'),
+        "upload_date": file_doc['uploadDate'].isoformat() if file_doc.get('uploadDate') else None,
+    }
+    return {k: v for k, v in file_data.items() if k in fields}
+
+def _list_gallery_files(user, args, files_collection):
+    """Builds one page of a user's gallery with GridFS metadata."""
+    gallery = user.get('gallery', [])
+    gallery_names = {file_obj['id']: file_obj['filename'] for file_obj in gallery}
+
+    sort_field = GALLERY_SORT_FIELDS.get(args.get('sort_by', 'upload_date'), 'uploadDate')
+    sort_order = ASCENDING if args.get('sort_order', 'desc') == 'asc' else DESCENDING
+    limit = min(max(int(args.get('limit', GALLERY_DEFAULT_LIMIT)), 1), GALLERY_MAX_LIMIT)
+
+    fields = [f for f in args.get('fields', '').split(',') if f in GALLERY_FIELDS] or list(GALLERY_FIELDS)
+    if 'id' not in fields:
+        fields.append('id')  # Always needed to download, key or page through the list
+    projection = {GALLERY_FIELDS[f]: 1 for f in fields}
+    projection[sort_field] = 1
+
+    file_ids = [ObjectId(file_id) for file_id in gallery_names]
+    file_query = {}
+    _add_gallery_filters(args, file_query)
+
+    page_query = {}
+    if args.get('cursor'):
+        last_value, last_id = _decode_gallery_cursor(args['cursor'])
+        past = "$gt" if sort_order == ASCENDING else "$lt"
+        page_query = {"$or": [
+            {sort_field: {past: last_value}},
+            {sort_field: last_value, "_id": {past: last_id}},
+        ]}
+
+    # One pass: the page after the cursor, and how many files match the filters overall
+    result = next(files_collection.aggregate([
+        {"$match": {"_id": {"$in": file_ids}}},
+        {"$addFields": {"size": {"$ifNull": ["$metadata.original_length", "$length"]}}},
+        {"$match": file_query},
+        {"$facet": {
+            "files": [
+                {"$match": page_query},
+                {"$sort": {sort_field: sort_order, "_id": sort_order}},
+                {"$limit": limit + 1},
+                {"$project": projection},
+            ],
+            "total": [{"$count": "count"}],
+        }},
+    ]))
+    file_docs = result['files']
+    has_more = len(file_docs) > limit
+    file_docs = file_docs[:limit]
+
+    return {
+        "files": [_serialize_gallery_file(doc, gallery_names, fields) for doc in file_docs],
+        "next_cursor": _encode_gallery_cursor(file_docs[-1], sort_field) if has_more else None,
+        "total_files": result['total'][0]['count'] if result['total'] else 0,
+        "gallery_total": len(gallery)
+    }
+
 @app.route('/my-files', methods=['GET'])
 @token_required
 def get_my_files(current_user):
     if current_user.get('role', 'user').lower() != 'user':
         return jsonify({"message": "Only users can see their files"}), 403
-        
-    updated_user = user_collection.find_one({"_id": current_user['_id']})
-    return jsonify(updated_user.get('gallery', [])), 200
+
+    try:
+        page = _list_gallery_files(current_user, request.args, _db_for_read(current_user)['fs.files'])
+    except ValueError:
+        return jsonify({"message": "Invalid paging or filter parameters"}), 400
+    return jsonify(page), 200
+
+@app.route('/users/<string:user_id>/files', methods=['GET'])
+@token_required
+def get_user_files(current_user, user_id):
+    if not is_employee_or_admin(current_user):
+        return jsonify({"message": "Dashboard access required"}), 403
+
+    try:
+        user = _users_for_read(current_user).find_one({"_id": ObjectId(user_id)}, {"gallery": 1})
+    except Exception:
+        return jsonify({"message": "Invalid User ID"}), 400
+
+    if not user:
+        return jsonify({"message": ERROR_MSG_USER_NOT_FOUND}), 404
+
+    try:
+        page = _list_gallery_files(user, request.args, _db_for_read(current_user)['fs.files'])
+    except ValueError:
+        return jsonify({"message": "Invalid paging or filter parameters"}), 400
+    return jsonify(page), 200
 
 @app.route('/my-profile', methods=['PUT'])
 @token_required
@@ -387,8 +1862,7 @@ def update_my_profile(current_user):
     if 'password' in data and data['password']:
         updates['password_hash'] = generate_password_hash(data['password'])
 
-    user_collection.update_one({"_id": current_user['_id']}, {"$set": updates})
-    updated_user = user_collection.find_one({"_id": current_user['_id']})
+    updated_user = user_repository.set_fields(current_user['_id'], updates)
     return jsonify(serialize_user(updated_user, include_email=True)), 200
 
 @app.route('/my-profile/pic', methods=['POST'])
@@ -406,20 +1880,14 @@ def update_my_profile_pic(current_user):
 
     if current_user.get('profile_pic_id'):
         try:
-            fs.delete(ObjectId(current_user['profile_pic_id']))
+            delete_stored_file(current_user['profile_pic_id'])
         except Exception as e:
             print(f"Old profile pic not found or cound not be deleted: {e}")
 
     filename = secure_filename(file.filename)
-    file_id = fs.put(file, filename=filename, content_type=file.mimetype)
-    new_profile_pic_id = str(file_id)
+    new_profile_pic_id = store_file(file, filename, file.mimetype)
     
-    user_collection.update_one(
-        {"_id": current_user['_id']},
-        {"$set": {"profile_pic_id": new_profile_pic_id}}
-    )
-    
-    updated_user = user_collection.find_one({"_id": current_user['_id']})
+    updated_user = user_repository.set_fields(current_user['_id'], {"profile_pic_id": new_profile_pic_id})
     return jsonify(serialize_user(updated_user, include_email=True)), 200
 
 
@@ -437,9 +1905,6 @@ def admin_create_user(current_user):
     
     if selected_date and not is_over_18(selected_date):
         errors.append(ERROR_MSG_18_PLUS)
-        
-    if user_collection.find_one({"email": email}):
-        errors.append(ERROR_MSG_EMAIL_EXISTS)
     
     if errors:
         return jsonify({"message": "\n".join(errors)}), 400
@@ -453,8 +1918,7 @@ def admin_create_user(current_user):
         file = request.files['profile_pic']
         if file.filename != '':
             filename = secure_filename(file.filename)
-            file_id = fs.put(file, filename=filename, content_type=file.mimetype)
-            profile_pic_id = str(file_id)
+            profile_pic_id = store_file(file, filename, file.mimetype)
 
     new_user = {
         "name": name,
@@ -469,8 +1933,11 @@ def admin_create_user(current_user):
         "gallery": []
     }
     
-    result = user_collection.insert_one(new_user)
-    new_user['_id'] = result.inserted_id
+    try:
+        user_repository.create(new_user)
+    except DuplicateKeyError:
+        _discard_stored_files([profile_pic_id] if profile_pic_id else [])
+        return jsonify({"message": ERROR_MSG_EMAIL_EXISTS}), 400
     
     return jsonify(serialize_user(new_user, include_email=True)), 201
 
@@ -493,7 +1960,7 @@ def admin_update_user(current_user, user_id):
         return jsonify({"message": "This endpoint is only for editing 'user' roles"}), 400
 
     data = request.form
-    errors = _validate_admin_user_update(data, user_to_update)
+    errors = _validate_admin_user_update(data)
     if errors:
         return jsonify({"message": "\n".join(errors)}), 400
 
@@ -502,29 +1969,30 @@ def admin_update_user(current_user, user_id):
     if 'profile_pic' in request.files:
         file = request.files['profile_pic']
         if file.filename != '':
-            updates['profile_pic_id'] = _handle_admin_profile_pic_update(file, user_to_update)
+            filename = secure_filename(file.filename)
+            updates['profile_pic_id'] = store_file(file, filename, file.mimetype)
 
+    updated_user = user_to_update
     if updates:
-         user_collection.update_one({"_id": ObjectId(user_id)}, {"$set": updates})
-         
-    updated_user = user_collection.find_one({"_id": ObjectId(user_id)})
+        try:
+            updated_user = user_repository.set_fields(user_id, updates)
+        except DuplicateKeyError:
+            _discard_stored_files([updates['profile_pic_id']] if 'profile_pic_id' in updates else [])
+            return jsonify({"message": ERROR_MSG_EMAIL_EXISTS}), 400
+
+    if 'profile_pic_id' in updates:
+        _delete_user_profile_pic(user_to_update)
+
     return jsonify(serialize_user(updated_user, include_email=True)), 200
 
 # --- These helpers are used by admin_update_user ---
-def _validate_admin_user_update(data, user_to_update):
+def _validate_admin_user_update(data):
     """Helper to validate admin updates for a user."""
     errors = validate_user_data(data, is_create=False, check_password=True)
-    user_id = str(user_to_update['_id'])
     
     selected_date = data.get('selected_date')
     if selected_date and not is_over_18(selected_date):
         errors.append(ERROR_MSG_18_PLUS)
-
-    email = data.get('email', '').lower()
-    if email and email != user_to_update.get('email'):
-        existing_user = user_collection.find_one({"email": email})
-        if existing_user and str(existing_user['_id']) != user_id:
-            errors.append(ERROR_MSG_EMAIL_EXISTS)
     
     if data.get('account_type') == 'management':
         errors.append("Cannot assign 'management' account type to a 'user' role.")
@@ -536,7 +2004,7 @@ def _build_admin_user_updates(data):
     updates = {
         "name": data.get('name'),
         "selected_date": data.get('selected_date'),
-        "email": data.get('email', '').lower(),
+        "email": data.get('email', '').lower() or None,
         "account_type": data.get('account_type'),
         "needs_sensitive_storage": data.get('needs_sensitive_storage') == 'true',
     }
@@ -547,17 +2015,6 @@ def _build_admin_user_updates(data):
     
     return updates
 
-def _handle_admin_profile_pic_update(file, user_to_update):
-    """Helper to delete old pic and save new one."""
-    if user_to_update.get('profile_pic_id'):
-        try:
-            fs.delete(ObjectId(user_to_update['profile_pic_id']))
-        except Exception as e:
-            print(f"Old pic not found: {e}")
-    
-    filename = secure_filename(file.filename)
-    file_id = fs.put(file, filename=filename, content_type=file.mimetype)
-    return str(file_id)
 
 
 # --- Admin/Dashboard Routes ---
@@ -624,6 +2081,53 @@ def _build_user_query(args):
 # --- END: REFACTOR FOR L566 ---
 
 
+# --- In-Memory Query Matching (for live events) ---
+#
+# Evaluates the subset of MongoDB query syntax produced by _build_user_query
+# against a single document, so events can be filtered per viewer.
+
+def _as_naive_utc(value):
+    if isinstance(value, dt) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _matches_condition(value, condition):
+    """Checks one field value against an operator dict or a literal."""
+    if not isinstance(condition, dict):
+        return value == condition
+
+    value = _as_naive_utc(value)
+    for operator, operand in condition.items():
+        if operator == '$regex':
+            flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+            try:
+                if not isinstance(value, str) or not re.search(operand, value, flags):
+                    return False
+            except re.error:
+                return False
+        elif operator == '$in' and value not in operand:
+            return False
+        elif operator == '$gte' and (value is None or value < operand):
+            return False
+        elif operator == '$lte' and (value is None or value > operand):
+            return False
+    return True
+
+def _matches_query(doc, query):
+    """Checks if a document matches a query built by _build_user_query."""
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(_matches_query(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == '$or':
+            if not any(_matches_query(doc, sub_query) for sub_query in condition):
+                return False
+        elif not _matches_condition(doc.get(key), condition):
+            return False
+    return True
+# --- End Query Matching ---
+
+
 @app.route('/users', methods=['GET'])
 @token_required
 def get_users(current_user):
@@ -638,24 +2142,41 @@ def get_users(current_user):
     
     # Build query using the helper
     query = _build_user_query(request.args)
+
+    # Recent writers read from the primary, so they skip the cache as well
+    use_cache = users_cache is not None and not _wrote_recently(current_user)
+    if use_cache:
+        cache_key = json_util.dumps([query, sort_by, sort_order, page, limit], sort_keys=True)
+        generation = users_cache.generation()
+        body = users_cache.get(cache_key, generation)
+        if body is not None:
+            return Response(body, mimetype='application/json')
+
+    users = user_collection if use_cache else _users_for_read(current_user)
         
-    total_users = user_collection.count_documents(query)
+    total_users = users.count_documents(query)
     total_pages = (total_users + limit - 1) // limit
     
-    users_cursor = user_collection.find(query)\
-                                  .sort(sort_by, sort_order)\
-                                  .skip((page - 1) * limit)\
-                                  .limit(limit)
+    users_cursor = users.find(query)\
+                    .sort(sort_by, sort_order)\
+                    .skip((page - 1) * limit)\
+                    .limit(limit)
 
-    users_safe = [serialize_user(user, include_email=True) for user in users_cursor]
+    users_safe = [serialize_user(user, include_email=True, include_gallery=False) for user in users_cursor]
 
-    return jsonify({
+    response = jsonify({
         "users": users_safe,
         "page": page,
         "limit": limit,
         "total_users": total_users,
         "total_pages": total_pages
     })
+    if use_cache:
+        try:
+            users_cache.put(cache_key, generation, response.get_data())
+        except OSError as e:
+            print(f"Error writing users cache: {e}")
+    return response
 
 @app.route('/users/<string:user_id>', methods=['GET'])
 @token_required
@@ -664,13 +2185,62 @@ def get_user(current_user, user_id):
         return jsonify({"message": "Dashboard access required"}), 403
         
     try:
-        user = user_collection.find_one({"_id": ObjectId(user_id)})
+        user = _users_for_read(current_user).find_one({"_id": ObjectId(user_id)})
         if user:
-            return jsonify(serialize_user(user, include_email=True)), 200
+            return jsonify(serialize_user(user, include_email=True, include_gallery=False)), 200
         return jsonify({"message": ERROR_MSG_USER_NOT_FOUND}), 404
     except Exception:
         return jsonify({"message": "Invalid User ID"}), 400
 
+def _format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_user_events(subscriber, query):
+    """Generator that turns bus events into SSE messages for one viewer."""
+    heartbeat = app.config['EVENTS_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + app.config['EVENTS_STREAM_MAX_SECONDS']
+    change_stream = None
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            # Tell the viewer whether writes from every worker reach this stream
+            # (change stream) or only those made in this process (in-process bus)
+            if change_stream != _change_stream_state['active']:
+                change_stream = _change_stream_state['active']
+                yield _format_sse('mode', {"change_stream": change_stream})
+
+            try:
+                event = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+
+            if event['type'] == 'resync':
+                yield _format_sse('resync', {})
+            elif event['type'] == 'delete' or not _matches_query(event['user'], query):
+                # Viewers drop the row if they have it; the id alone is enough
+                yield _format_sse('remove', {"id": str(event['id'])})
+            else:
+                yield _format_sse('upsert', serialize_user(event['user'], include_email=True, include_gallery=False))
+    finally:
+        event_bus.unsubscribe(subscriber)
+
+@app.route('/events', methods=['GET'])
+@token_required
+def user_events(current_user):
+    if not is_employee_or_admin(current_user):
+        return jsonify({"message": "Dashboard access required"}), 403
+
+    _ensure_change_stream()
+    subscriber = event_bus.subscribe()
+    query = _build_user_query(request.args)
+
+    return Response(
+        stream_with_context(_stream_user_events(subscriber, query)),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/users', methods=['POST'])
 @token_required
 def create_user(current_user):
@@ -689,9 +2259,6 @@ def create_user(current_user):
         
     if selected_date and not is_over_18(selected_date):
         errors.append(ERROR_MSG_18_PLUS)
-
-    if user_collection.find_one({"email": email}):
-        errors.append(ERROR_MSG_EMAIL_EXISTS)
         
     if errors:
         return jsonify({"message": "\n".join(errors)}), 400
@@ -709,8 +2276,10 @@ def create_user(current_user):
         "selected_date": selected_date,
         "account_type": "management"
     }
-    result = user_collection.insert_one(new_user)
-    new_user['_id'] = result.inserted_id
+    try:
+        user_repository.create(new_user)
+    except DuplicateKeyError:
+        return jsonify({"message": ERROR_MSG_EMAIL_EXISTS}), 400
     
     return jsonify(serialize_user(new_user, include_email=True)), 201
 
@@ -722,15 +2291,11 @@ def _validate_staff_name(data, errors):
     if 'name' in data and (not name or len(name) < 2):
         errors.append("Name must be at least 2 characters long.")
 
-def _validate_staff_email(data, user_to_update, errors):
-    """Validates email for staff update."""
+def _validate_staff_email(data, errors):
+    """Validates email for staff update. Uniqueness is enforced by the index."""
     email = data.get('email', '').lower()
     if 'email' in data and (not email or not re.match(EMAIL_REGEX, email.lower())):
         errors.append("Please provide a valid email address.")
-    elif email and email != user_to_update.get('email'):
-        existing_user = user_collection.find_one({"email": email})
-        if existing_user and str(existing_user['_id']) != str(user_to_update['_id']):
-            errors.append(ERROR_MSG_EMAIL_EXISTS)
 
 def _validate_staff_password(data, errors):
     """Validates password for staff update."""
@@ -750,11 +2315,11 @@ def _validate_staff_dob(data, errors):
     if selected_date and not is_over_18(selected_date):
         errors.append(ERROR_MSG_18_PLUS)
 
-def _validate_staff_update(data, user_to_update):
+def _validate_staff_update(data):
     """Helper to validate admin updates for a staff member."""
     errors = []
     _validate_staff_name(data, errors)
-    _validate_staff_email(data, user_to_update, errors)
+    _validate_staff_email(data, errors)
     _validate_staff_password(data, errors)
     _validate_staff_role(data, errors)
     _validate_staff_dob(data, errors)
@@ -779,7 +2344,7 @@ def update_user(current_user, user_id):
             
     data = request.json
     
-    errors = _validate_staff_update(data, user_to_update)
+    errors = _validate_staff_update(data)
     if errors:
         return jsonify({"message": "\n".join(errors)}), 400
 
@@ -795,13 +2360,13 @@ def update_user(current_user, user_id):
     if 'password' in data and data['password']:
         updates['password_hash'] = generate_password_hash(data['password'])
 
+    updated_user = user_to_update
     if updates:
-        user_collection.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": updates}
-        )
+        try:
+            updated_user = user_repository.set_fields(user_id, updates)
+        except DuplicateKeyError:
+            return jsonify({"message": ERROR_MSG_EMAIL_EXISTS}), 400
     
-    updated_user = user_collection.find_one({"_id": ObjectId(user_id)})
     return jsonify(serialize_user(updated_user, include_email=True)), 200
 
 
@@ -813,7 +2378,7 @@ def _delete_user_gallery_files(user_to_delete):
         print(f"User {user_to_delete['_id']} is a 'user'. Deleting their {len(user_to_delete['gallery'])} files...")
         for file_obj in user_to_delete['gallery']:
             try:
-                fs.delete(ObjectId(file_obj['id']))
+                delete_stored_file(file_obj['id'])
                 print(f"  > Deleted file {file_obj['id']} ({file_obj['filename']})")
             except Exception as e:
                 print(f"  > Error deleting file {file_obj['id']}: {e}")
@@ -822,7 +2387,7 @@ def _delete_user_profile_pic(user_to_delete):
     """Helper to delete a user's profile picture."""
     if user_to_delete.get('profile_pic_id'):
         try:
-            fs.delete(ObjectId(user_to_delete['profile_pic_id']))
+            delete_stored_file(user_to_delete['profile_pic_id'])
             print(f"  > Deleted profile pic {user_to_delete['profile_pic_id']}")
         except Exception as e:
             print(f"  > Error deleting profile pic: {e}")
@@ -834,16 +2399,14 @@ def delete_user(current_user, user_id):
         return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
         
     try:
-        user_to_delete = user_collection.find_one({"_id": ObjectId(user_id)})
+        # Delete the user first so nobody can reach files that are being removed
+        user_to_delete = user_repository.delete(user_id)
         if not user_to_delete:
             return jsonify({"message": ERROR_MSG_USER_NOT_FOUND}), 404
 
         # Call helpers to do the complex work
         _delete_user_gallery_files(user_to_delete)
         _delete_user_profile_pic(user_to_delete)
-                
-        # Now the main function just deletes the user
-        user_collection.delete_one({"_id": ObjectId(user_id)})
             
         return jsonify({"message": "User and all associated files deleted"}), 200
     except Exception as e:
@@ -869,16 +2432,12 @@ def admin_add_file_to_user(current_user, user_id):
         return jsonify({"message": "No selected file"}), 400
         
     filename = secure_filename(file.filename)
-    file_id = fs.put(file, filename=filename, content_type=file.mimetype)
     file_obj = {
-        "id": str(file_id),
+        "id": store_file(file, filename, file.mimetype),
         "filename": filename
     }
 
-    user_collection.update_one(
-        {"_id": ObjectId(user_id)},
-        {"$push": {"gallery": file_obj}}
-    )
+    user_repository.push_gallery_files(user_id, [file_obj])
     
     return jsonify({"message": "File added successfully", "file": file_obj}), 201
 
@@ -889,16 +2448,11 @@ def admin_delete_file(current_user, file_id):
         return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
         
     try:
-        user = user_collection.find_one({"gallery.id": file_id})
+        user = user_repository.pull_gallery_file(file_id)
         if not user:
             return jsonify({"message": "File not found in any user gallery"}), 404
             
-        fs.delete(ObjectId(file_id))
-        
-        user_collection.update_one(
-            {"_id": user['_id']},
-            {"$pull": {"gallery": {"id": file_id}}}
-        )
+        delete_stored_file(file_id)
         
         return jsonify({"message": "File deleted successfully"}), 200
     except Exception as e:
@@ -906,5 +2460,201 @@ def admin_delete_file(current_user, file_id):
         return jsonify({"message": "File not found or invalid ID"}), 404
         
 
+# --- Storage Migration ---
+#
+# Moves files between storage backends in a background thread. Each file is
+# copied to the target, its catalogue entry is switched over, and only then are
+# the old bytes removed, so downloads keep working throughout.
+
+_migration_status = {"running": False}
+_migration_lock = threading.Lock()
+
+def _backend_match(backend_name):
+    """Query value for metadata.backend that selects files in a backend."""
+    if backend_name == GridFSStorage.name:
+        return {"$in": [None, GridFSStorage.name]}
+    return backend_name
+
+def _migrate_stored_file(file_doc, target):
+    source = _storage_for(file_doc)
+    target_backend = storage_backends[target]
+
+    target_backend.remove(file_doc)  # Clear leftovers from an interrupted run
+    target_backend.write(
+        file_doc['_id'],
+        _ChunkReader(source.iter_chunks(file_doc, db)),
+        file_doc.get('chunkSize') or app.config['STORAGE_CHUNK_SIZE']
+    )
+
+    result = file_catalog.update_one(
+        {"_id": file_doc['_id'], "metadata.backend": _backend_match(source.name)},
+        {"$set": {"metadata.backend": target}}
+    )
+    if result.modified_count:
+        source.remove(file_doc)
+    else:
+        # Deleted or moved by someone else while we were copying
+        target_backend.remove(file_doc)
+
+def _run_storage_migration(target):
+    last_id = None
+    try:
+        while True:
+            # Inline files are inline because of their size, not the backend choice
+            file_query = {"$nor": [
+                {"metadata.backend": _backend_match(target)},
+                {"metadata.backend": InlineStorage.name},
+            ]}
+            if last_id:
+                file_query["_id"] = {"$gt": last_id}
+            batch = list(file_catalog.find(file_query).sort("_id", ASCENDING).limit(100))
+            if not batch:
+                break
+            for file_doc in batch:
+                last_id = file_doc['_id']
+                try:
+                    _migrate_stored_file(file_doc, target)
+                    _migration_status['migrated'] += 1
+                except Exception as e:
+                    print(f"  > Error migrating file {file_doc['_id']}: {e}")
+                    _migration_status['failed'] += 1
+    finally:
+        _migration_status['running'] = False
+        _migration_status['finished_date'] = dt.now(timezone.utc).isoformat()
+
+@app.route('/admin/storage/migrate', methods=['GET'])
+@token_required
+def get_storage_migration(current_user):
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+    return jsonify(_migration_status), 200
+
+@app.route('/admin/storage/migrate', methods=['POST'])
+@token_required
+def start_storage_migration(current_user):
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    target = (request.json or {}).get('target')
+    targets = [name for name in storage_backends if name != InlineStorage.name]
+    if target not in targets:
+        return jsonify({"message": f"Target must be one of: {', '.join(targets)}"}), 400
+
+    with _migration_lock:
+        if _migration_status['running']:
+            return jsonify({"message": "A storage migration is already running"}), 409
+        _migration_status.clear()
+        _migration_status.update({
+            "running": True,
+            "target": target,
+            "migrated": 0,
+            "failed": 0,
+            "started_date": dt.now(timezone.utc).isoformat()
+        })
+
+    threading.Thread(target=_run_storage_migration, args=(target,), daemon=True).start()
+    return jsonify(_migration_status), 202
+
+# --- Request Profile Routes ---
+PROFILE_SUMMARY_PROJECTION = {"collapsed": 0, "allocations": 0, "mongo_commands": 0}
+
+def _serialize_profile(profile):
+    profile_data = {k: v for k, v in profile.items() if k != '_id'}
+    profile_data['id'] = str(profile['_id'])
+    profile_data['created_date'] = profile['created_date'].isoformat()
+    return profile_data
+
+@app.route('/admin/profiles', methods=['GET'])
+@token_required
+def list_profiles(current_user):
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    profiles = profiles_collection.find({}, PROFILE_SUMMARY_PROJECTION).sort("created_date", DESCENDING).limit(50)
+    return jsonify([_serialize_profile(profile) for profile in profiles]), 200
+
+def _serialize_profile_arm(arm):
+    return {
+        "id": str(arm['_id']),
+        "user_id": arm.get('user_id'),
+        "path": arm.get('path'),
+        "armed_by": arm['armed_by'],
+        "expires_at": _as_naive_utc(arm['expires_at']).isoformat(),
+    }
+
+@app.route('/admin/profiles/arm', methods=['POST'])
+@token_required
+def arm_profile(current_user):
+    """
+    Profiles the next request made by 'user_id', to 'path', or both. The request
+    runs normally for its user; the profile shows up in GET /admin/profiles.
+    """
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    data = request.json or {}
+    user_id = data.get('user_id') or None
+    path = data.get('path') or None
+    if not user_id and not path:
+        return jsonify({"message": "user_id or path is required"}), 400
+    if path is not None and (not isinstance(path, str) or not path.startswith('/')):
+        return jsonify({"message": "path must start with '/'"}), 400
+    if user_id is not None:
+        try:
+            if not user_collection.find_one({"_id": ObjectId(user_id)}, {"_id": 1}):
+                return jsonify({"message": ERROR_MSG_USER_NOT_FOUND}), 404
+        except Exception:
+            return jsonify({"message": "Invalid User ID"}), 400
+
+    arm = {
+        "user_id": user_id,
+        "path": path,
+        "armed_by": str(current_user['_id']),
+        "created_date": dt.now(timezone.utc),
+        "expires_at": dt.now(timezone.utc) + app.config['PROFILE_ARM_TTL'],
+    }
+    arm['_id'] = profile_arms_collection.insert_one(arm).inserted_id
+    _reload_profile_arms()
+    return jsonify(_serialize_profile_arm(arm)), 201
+
+@app.route('/admin/profiles/arms', methods=['GET'])
+@token_required
+def list_profile_arms(current_user):
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    arms = profile_arms_collection.find({"expires_at": {"$gt": dt.now(timezone.utc)}}).sort("created_date", ASCENDING)
+    return jsonify([_serialize_profile_arm(arm) for arm in arms]), 200
+
+@app.route('/admin/profiles/<string:profile_id>', methods=['GET'])
+@token_required
+def get_profile(current_user, profile_id):
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    try:
+        profile = profiles_collection.find_one({"_id": ObjectId(profile_id)})
+    except Exception:
+        return jsonify({"message": "Invalid profile ID"}), 400
+    if not profile:
+        return jsonify({"message": "Profile not found"}), 404
+    return jsonify(_serialize_profile(profile)), 200
+
+@app.route('/admin/profiles/<string:profile_id>/collapsed', methods=['GET'])
+@token_required
+def get_profile_collapsed(current_user, profile_id):
+    """Returns the stack samples as text for flamegraph.pl, speedscope and similar tools."""
+    if not is_admin(current_user):
+        return jsonify({"message": ERROR_MSG_ADMIN_REQUIRED}), 403
+
+    try:
+        profile = profiles_collection.find_one({"_id": ObjectId(profile_id)}, {"collapsed": 1})
+    except Exception:
+        return jsonify({"message": "Invalid profile ID"}), 400
+    if not profile:
+        return jsonify({"message": "Profile not found"}), 404
+    return Response(profile['collapsed'] + "\n", mimetype='text/plain')
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -3,6 +3,11 @@
 // (Contains the API helper class for all backend communication)
 // ===================================================================================
 
+// Resumable upload retries: exponential backoff from 1s, capped at 30s
+const UPLOAD_MAX_RETRIES = 8;
+const UPLOAD_RETRY_BASE_DELAY = 1000;
+const UPLOAD_RETRY_MAX_DELAY = 30000;
+
 class API {
   constructor(baseUrl) {
     this.baseUrl = baseUrl;
@@ -139,8 +144,90 @@ class API {
     });
   }
 
-  getMyFiles(token) {
-    return this.request('/my-files', { token });
+  /**
+   * Uploads a single large file in chunks through the resumable /uploads API.
+   * A failed chunk re-queries the server offset and resumes from there.
+   */
+  async uploadFileResumable(file, token, onProgress = () => {}) {
+    // Remember the session so a later attempt (or a page reload) resumes it
+    const storageKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    let session = null;
+    const savedUploadId = window.localStorage.getItem(storageKey);
+    if (savedUploadId) {
+      try {
+        session = await this.request(`/uploads/${savedUploadId}`, { token });
+      } catch (error) {
+        window.localStorage.removeItem(storageKey); // Expired or not ours; start over
+      }
+    }
+    if (!session) {
+      session = await this.request('/uploads', {
+        method: 'POST',
+        body: { filename: file.name, size: file.size, content_type: file.type },
+        token,
+      });
+      window.localStorage.setItem(storageKey, session.upload_id);
+    }
+
+    const uploadId = session.upload_id;
+    let offset = session.offset;
+    let retries = 0;
+    onProgress(offset / file.size);
+
+    while (offset < file.size) {
+      try {
+        if (retries > 0) {
+          // Back off, then ask the server where to continue
+          const delay = Math.min(UPLOAD_RETRY_BASE_DELAY * 2 ** (retries - 1), UPLOAD_RETRY_MAX_DELAY);
+          await new Promise((resolve) => setTimeout(resolve, delay));
+          const status = await this.request(`/uploads/${uploadId}`, { token });
+          offset = status.offset;
+          if (offset >= file.size) {
+            break;
+          }
+        }
+
+        const chunk = file.slice(offset, offset + session.chunk_size);
+        const buffer = await chunk.arrayBuffer();
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        const checksum = Array.from(new Uint8Array(digest))
+          .map((b) => b.toString(16).padStart(2, '0'))
+          .join('');
+
+        const response = await fetch(`${this.baseUrl}/uploads/${uploadId}?offset=${offset}`, {
+          method: 'PUT',
+          headers: {
+            'Authorization': `Bearer ${token}`,
+            'Content-Type': 'application/octet-stream',
+            'X-Chunk-SHA256': checksum,
+          },
+          body: buffer,
+        });
+        const data = await this._handleJsonResponse(response);
+        offset = data.offset;
+        retries = 0;
+        onProgress(offset / file.size);
+      } catch (error) {
+        retries += 1;
+        if (retries > UPLOAD_MAX_RETRIES) {
+          throw error; // The session stays saved, so trying again later resumes it
+        }
+      }
+    }
+
+    const result = await this.request(`/uploads/${uploadId}/complete`, { method: 'POST', token });
+    window.localStorage.removeItem(storageKey);
+    return result;
+  }
+
+  getMyFiles(token, params = {}) {
+    const query = new URLSearchParams(params).toString();
+    return this.request(`/my-files?${query}`, { token });
+  }
+
+  getUserFiles(userId, token, params = {}) {
+    const query = new URLSearchParams(params).toString();
+    return this.request(`/users/${userId}/files?${query}`, { token });
   }
 
   updateMyProfile(profileData, token) {
@@ -166,11 +253,106 @@ class API {
     return this.request(`/users?${query}`, { token });
   }
 
+  /**
+   * Opens the /events stream for the given dashboard filters and dispatches
+   * 'mode', 'upsert', 'remove' and 'resync' events to the matching handlers.
+   * Every reconnect also calls onResync, since events may be missed in between.
+   * Uses fetch (not EventSource) so the token can go in the Authorization header.
+   * Returns a function that closes the stream.
+   */
+  subscribeToUserEvents(params, token, handlers) {
+    const controller = new AbortController();
+    const query = new URLSearchParams(params).toString();
+    let retryTimer = null;
+    let hasConnected = false;
+
+    const connect = async () => {
+      let delay = 0;
+      try {
+        const response = await fetch(`${this.baseUrl}/events?${query}`, {
+          headers: { 'Authorization': `Bearer ${token}` },
+          signal: controller.signal,
+        });
+        if (response.status === 401) {
+          window.dispatchEvent(new Event('auth-error'));
+          return;
+        }
+        if (!response.ok || !response.body) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        handlers.onOpen?.();
+        if (hasConnected) {
+          handlers.onResync?.();
+        }
+        hasConnected = true;
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const messages = buffer.split('\n\n');
+          buffer = messages.pop();
+          messages.forEach((message) => this._dispatchServerEvent(message, handlers));
+        }
+      } catch (error) {
+        if (controller.signal.aborted) return;
+        console.error('Event stream failed:', error);
+        delay = 3000;
+      }
+      handlers.onClose?.();
+      if (!controller.signal.aborted) {
+        retryTimer = setTimeout(connect, delay);
+      }
+    };
+
+    connect();
+    return () => {
+      controller.abort();
+      clearTimeout(retryTimer);
+    };
+  }
+
+  /**
+   * Parses one SSE message block and calls its handler
+   * @private
+   */
+  _dispatchServerEvent(message, handlers) {
+    let event = 'message';
+    let data = '';
+    message.split('\n').forEach((line) => {
+      if (line.startsWith('event:')) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith('data:')) {
+        data += line.slice(5).trim();
+      }
+    });
+    if (!data) return; // Keep-alive comments and retry hints
+
+    const handler = {
+      mode: handlers.onMode,
+      upsert: handlers.onUpsert,
+      remove: handlers.onRemove,
+      resync: handlers.onResync,
+    }[event];
+    if (handler) {
+      handler(JSON.parse(data));
+    }
+  }
+
   downloadFile(fileId, token) {
     // --- FIX: Tell the request function to expect a file ---
     return this.request(`/file/${fileId}`, { token, isFileDownload: true });
   }
 
+  downloadGalleryZip(userId, token, fileIds = []) {
+    const query = fileIds.length > 0 ? `?ids=${fileIds.join(',')}` : '';
+    return this.request(`/users/${userId}/files.zip${query}`, { token, isFileDownload: true });
+  }
+
   // --- NEW: Staff Management Methods ---
   getStaff(token) {
     return this.request('/staff', { token });
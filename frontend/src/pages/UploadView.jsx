@@ -3,9 +3,21 @@ import api from '../api';
 import { Modal, UserForm } from '../components';
 import PropTypes from 'prop-types'; // 1. IMPORT PROPTYPES
 
+// Files at or above this size go through the resumable chunked upload API
+const RESUMABLE_UPLOAD_THRESHOLD = 16 * 1024 * 1024;
+const FILES_PAGE_SIZE = 50;
+
+const formatFileSize = (bytes) => {
+  if (bytes == null) return '';
+  if (bytes < 1024) return `${bytes} B`;
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+};
+
 // --- View 3: UploadView (for 'user' role) ---
 export function UploadView({ token, onLogout, currentUser }) {
   const [myFiles, setMyFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [error, setError] = useState(null);
   const [success, setSuccess] = useState(null);
   const [selectedFiles, setSelectedFiles] = useState(null);
@@ -35,10 +47,15 @@ export function UploadView({ token, onLogout, currentUser }) {
   }, [currentUser]);
   
 
-  const fetchMyFiles = useCallback(async () => {
+  const fetchMyFiles = useCallback(async (cursor = null) => {
     try {
-      const files = await api.getMyFiles(token);
-      setMyFiles(files);
+      const params = { limit: FILES_PAGE_SIZE };
+      if (cursor) {
+        params.cursor = cursor;
+      }
+      const page = await api.getMyFiles(token, params);
+      setMyFiles(prev => (cursor ? [...prev, ...page.files] : page.files));
+      setNextCursor(page.next_cursor);
     } catch (err) {
       setError(err.message);
     }
@@ -70,14 +87,23 @@ export function UploadView({ token, onLogout, currentUser }) {
     setError(null);
     setSuccess(null);
 
-    const formData = new FormData();
-    for (const file of selectedFiles) {
-      formData.append('files_to_upload', file);
-    }
+    const smallFiles = Array.from(selectedFiles).filter(file => file.size < RESUMABLE_UPLOAD_THRESHOLD);
+    const largeFiles = Array.from(selectedFiles).filter(file => file.size >= RESUMABLE_UPLOAD_THRESHOLD);
     
     try {
-      const result = await api.uploadFiles(formData, token);
-      setSuccess(result.message);
+      if (smallFiles.length > 0) {
+        const formData = new FormData();
+        for (const file of smallFiles) {
+          formData.append('files_to_upload', file);
+        }
+        await api.uploadFiles(formData, token);
+      }
+      for (const file of largeFiles) {
+        await api.uploadFileResumable(file, token, (progress) => {
+          setSuccess(`Uploading ${file.name}... ${Math.round(progress * 100)}%`);
+        });
+      }
+      setSuccess(`Successfully uploaded ${selectedFiles.length} files.`);
       fetchMyFiles(); // Refresh the file list
       if(fileInputRef.current) {
         fileInputRef.current.value = "";
@@ -176,7 +202,13 @@ export function UploadView({ token, onLogout, currentUser }) {
             // --- 2. FIX: Use 'file.id' for the key ---
             myFiles.map(file => (
               <div key={file.id} className="flex justify-between items-center p-2 bg-white dark:bg-gray-800 border dark:border-gray-600 rounded">
-                <span className="text-sm text-gray-700 dark:text-gray-300">{file.filename}</span>
+                <div className="flex flex-col">
+                  <span className="text-sm text-gray-700 dark:text-gray-300">{file.filename}</span>
+                  <span className="text-xs text-gray-500 dark:text-gray-400">
+                    {formatFileSize(file.size)}
+                    {file.upload_date && ` · ${new Date(file.upload_date).toLocaleDateString()}`}
+                  </span>
+                </div>
                 <button 
                   onClick={() => handleDownload(file.id, file.filename)}
                   className="text-sm text-indigo-600 hover:text-indigo-800 dark:text-indigo-400 dark:hover:text-indigo-200 font-medium"
@@ -188,6 +220,14 @@ export function UploadView({ token, onLogout, currentUser }) {
           ) : (
             <p className="text-sm text-gray-500 dark:text-gray-400 text-center">You have not uploaded any files yet.</p>
           )}
+          {nextCursor && (
+            <button
+              onClick={() => fetchMyFiles(nextCursor)}
+              className="w-full text-sm text-indigo-600 hover:text-indigo-800 dark:text-indigo-400 dark:hover:text-indigo-200 font-medium"
+            >
+              Load more
+            </button>
+          )}
         </div>
       </div>
       
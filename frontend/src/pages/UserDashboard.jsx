@@ -24,6 +24,7 @@ function useClickOutside(ref, handler) {
 
 const ALL_ROLES = ['admin', 'employee', 'user'];
 const ALL_ACCOUNT_TYPES = ['personal', 'professional', 'academic', 'management'];
+const GALLERY_PAGE_SIZE = 50;
 
 
 // --- FilterMenu Component (Extracted to reduce complexity) ---
@@ -167,8 +168,36 @@ function ExpandedRowContent({
   fileManagementError, 
   onFileAddClick, 
   onFileDownload, 
-  onFileDelete 
+  onDownloadAll,
+  onFileDelete,
+  onLoadFiles
 }) {
+  const [files, setFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filesError, setFilesError] = useState(null);
+
+  const loadFiles = useCallback(async (cursor = null) => {
+    try {
+      setFilesError(null);
+      const params = { limit: GALLERY_PAGE_SIZE, fields: 'filename' };
+      if (cursor) {
+        params.cursor = cursor;
+      }
+      const page = await onLoadFiles(user.id, params);
+      setFiles(prev => (cursor ? [...prev, ...page.files] : page.files));
+      setNextCursor(page.next_cursor);
+    } catch (err) {
+      setFilesError(`Failed to load files: ${err.message}`);
+    }
+  }, [user.id, onLoadFiles]);
+
+  // Reload from the first page whenever the user's file count changes
+  useEffect(() => {
+    if (user.role === 'user') {
+      loadFiles();
+    }
+  }, [user.role, user.gallery_count, loadFiles]);
+
   return (
     <tr className="bg-gray-50 dark:bg-gray-700">
       <td colSpan={isAdmin ? 7 : 6} className="p-4">
@@ -189,17 +218,30 @@ function ExpandedRowContent({
           <div className="mt-4">
             <div className="flex justify-between items-center mb-2">
               <h4 className="text-sm font-semibold text-gray-700 dark:text-gray-200">File Management:</h4>
-              <button
-                onClick={() => onFileAddClick(user.id)}
-                className="px-3 py-1 bg-green-500 text-white rounded-md hover:bg-green-600 text-xs"
-              >
-                Add File
-              </button>
+              <div className="space-x-2">
+                {user.gallery_count > 0 && (
+                  <button
+                    onClick={() => onDownloadAll(user.id, user.name)}
+                    className="px-3 py-1 bg-blue-500 text-white rounded-md hover:bg-blue-600 text-xs"
+                  >
+                    Download All
+                  </button>
+                )}
+                <button
+                  onClick={() => onFileAddClick(user.id)}
+                  className="px-3 py-1 bg-green-500 text-white rounded-md hover:bg-green-600 text-xs"
+                >
+                  Add File
+                </button>
+              </div>
             </div>
-            {user.gallery && user.gallery.length > 0 ? (
+            {filesError && (
+              <div className="text-red-500 text-sm mb-2">{filesError}</div>
+            )}
+            {files.length > 0 ? (
               <div className="grid grid-cols-1 md:grid-cols-2 gap-2">
                 {/* --- FIX: Use file.id as key --- */}
-                {user.gallery.map(file => (
+                {files.map(file => (
                   <div key={file.id} className="flex justify-between items-center p-2 bg-white dark:bg-gray-800 border border-gray-200 dark:border-gray-600 rounded shadow-sm">
                     <span className="text-sm text-indigo-600 dark:text-indigo-300 truncate" title={file.filename}>
                       {file.filename}
@@ -224,6 +266,14 @@ function ExpandedRowContent({
             ) : (
               <p className="text-sm text-gray-500 dark:text-gray-400">No files uploaded by this user.</p>
             )}
+            {nextCursor && (
+              <button
+                onClick={() => loadFiles(nextCursor)}
+                className="mt-2 text-sm text-indigo-600 hover:text-indigo-800 dark:text-indigo-400 dark:hover:text-indigo-200 font-medium"
+              >
+                Load more ({files.length} of {user.gallery_count})
+              </button>
+            )}
           </div>
         ) : (
           <p className="text-sm text-gray-500 dark:text-gray-400 mt-4">
@@ -239,18 +289,18 @@ function ExpandedRowContent({
 ExpandedRowContent.propTypes = {
   user: PropTypes.shape({
     id: PropTypes.string.isRequired,
+    name: PropTypes.string,
     needs_sensitive_storage: PropTypes.bool,
     role: PropTypes.string,
-    gallery: PropTypes.arrayOf(PropTypes.shape({
-      id: PropTypes.string.isRequired,
-      filename: PropTypes.string.isRequired,
-    })),
+    gallery_count: PropTypes.number,
   }).isRequired,
   isAdmin: PropTypes.bool.isRequired,
   fileManagementError: PropTypes.string,
   onFileAddClick: PropTypes.func.isRequired,
   onFileDownload: PropTypes.func.isRequired,
+  onDownloadAll: PropTypes.func.isRequired,
   onFileDelete: PropTypes.func.isRequired,
+  onLoadFiles: PropTypes.func.isRequired,
 };
 ExpandedRowContent.defaultProps = {
   fileManagementError: null,
@@ -280,7 +330,9 @@ function UserRow({
   fileManagementError,
   onFileAddClick,
   onFileDownload,
-  onFileDelete
+  onDownloadAll,
+  onFileDelete,
+  onLoadFiles
 }) {
   return (
     <React.Fragment>
@@ -318,7 +370,7 @@ function UserRow({
         </td>
         <td className="p-3 text-sm text-gray-700 dark:text-gray-300">
           <span className="px-2 py-1 inline-flex text-xs leading-5 font-semibold rounded-full bg-blue-100 text-blue-800 dark:bg-blue-900 dark:text-blue-200">
-            {user.gallery ? user.gallery.length : 0}
+            {user.gallery_count || 0}
           </span>
         </td>
         <td className="p-3 text-sm text-gray-700 dark:text-gray-300">{user.created_date ? new Date(user.created_date).toLocaleDateString() : 'N/A'}</td>
@@ -348,7 +400,9 @@ function UserRow({
           fileManagementError={fileManagementError}
           onFileAddClick={onFileAddClick}
           onFileDownload={onFileDownload}
+          onDownloadAll={onDownloadAll}
           onFileDelete={onFileDelete}
+          onLoadFiles={onLoadFiles}
         />
       )}
     </React.Fragment>
@@ -364,7 +418,7 @@ UserRow.propTypes = {
     email: PropTypes.string,
     role: PropTypes.string.isRequired,
     account_type: PropTypes.string,
-    gallery: PropTypes.array,
+    gallery_count: PropTypes.number,
     created_date: PropTypes.string,
   }).isRequired,
   isAdmin: PropTypes.bool.isRequired,
@@ -376,7 +430,9 @@ UserRow.propTypes = {
   fileManagementError: PropTypes.string,
   onFileAddClick: PropTypes.func.isRequired,
   onFileDownload: PropTypes.func.isRequired,
+  onDownloadAll: PropTypes.func.isRequired,
   onFileDelete: PropTypes.func.isRequired,
+  onLoadFiles: PropTypes.func.isRequired,
 };
 
 
@@ -512,22 +568,27 @@ function useUserDashboardState(token, currentUser) {
     name: '', email: '', password: '', role: 'employee', selected_date: '',
   }), []); 
 
+  // Filters shared by the list fetch and the live event stream
+  const filterParams = useMemo(() => ({
+    search: debouncedSearchTerm,
+    roles: selectedRoles.join(','),
+    start_date: startDate,
+    end_date: endDate,
+    account_types: selectedAccountTypes.join(','),
+    sensitivity: selectedSensitivity,
+  }), [debouncedSearchTerm, selectedRoles, startDate, endDate, selectedAccountTypes, selectedSensitivity]);
+
   // Data Fetching
   const fetchUsers = useCallback(async () => {
     setLoading(true);
     setError(null);
     try {
       const params = {
+        ...filterParams,
         page: currentPage,
         limit: 10,
-        search: debouncedSearchTerm,
         sort_by: sortBy,
         sort_order: sortOrder,
-        roles: selectedRoles.join(','),
-        start_date: startDate,
-        end_date: endDate,
-        account_types: selectedAccountTypes.join(','),
-        sensitivity: selectedSensitivity,
       };
       const data = await api.getUsers(params, token);
       setUsers(data.users);
@@ -537,11 +598,62 @@ function useUserDashboardState(token, currentUser) {
     } finally {
       setLoading(false);
     }
-  }, [token, currentPage, debouncedSearchTerm, sortBy, sortOrder, selectedRoles, startDate, endDate, selectedAccountTypes, selectedSensitivity]);
+  }, [token, currentPage, sortBy, sortOrder, filterParams]);
 
   useEffect(() => {
     fetchUsers();
   }, [fetchUsers]);
+
+  // --- Live Updates ---
+  // Rows already on this page are patched in place from /events. Rows entering
+  // or leaving the page change its position/count, so those trigger one
+  // debounced refetch instead.
+  const usersRef = useRef(users);
+  usersRef.current = users;
+  const fetchUsersRef = useRef(fetchUsers);
+  fetchUsersRef.current = fetchUsers;
+  const refetchTimerRef = useRef(null);
+  // True only while connected to a server that watches a change stream; the
+  // in-process fallback misses writes handled by other workers
+  const [hasChangeStream, setHasChangeStream] = useState(false);
+
+  const scheduleRefetch = useCallback(() => {
+    clearTimeout(refetchTimerRef.current);
+    refetchTimerRef.current = setTimeout(() => fetchUsersRef.current(), 500);
+  }, []);
+
+  useEffect(() => {
+    const unsubscribe = api.subscribeToUserEvents(filterParams, token, {
+      onMode: ({ change_stream }) => setHasChangeStream(change_stream),
+      onClose: () => setHasChangeStream(false),
+      onUpsert: (user) => {
+        if (usersRef.current.some(u => u.id === user.id)) {
+          setUsers(prev => prev.map(u => (u.id === user.id ? user : u)));
+        } else {
+          scheduleRefetch();
+        }
+      },
+      onRemove: ({ id }) => {
+        if (usersRef.current.some(u => u.id === id)) {
+          setUsers(prev => prev.filter(u => u.id !== id));
+          scheduleRefetch();
+        }
+      },
+      onResync: scheduleRefetch,
+    });
+    return () => {
+      unsubscribe();
+      clearTimeout(refetchTimerRef.current);
+      setHasChangeStream(false);
+    };
+  }, [token, filterParams, scheduleRefetch]);
+
+  // With a change stream our own writes come back as events from any worker
+  const refreshUnlessLive = useCallback(() => {
+    if (!hasChangeStream) {
+      fetchUsers();
+    }
+  }, [hasChangeStream, fetchUsers]);
   
   // Event Handlers
   const handleSort = (column) => {
@@ -609,6 +721,20 @@ function useUserDashboardState(token, currentUser) {
     }
   };
   
+  const handleDownloadAll = async (userId, name) => {
+    try {
+      setError(null);
+      await api.downloadGalleryZip(userId, token);
+    } catch (err) {
+      setError(`Failed to download files for ${name}: ${err.message}`);
+    }
+  };
+  
+  const loadUserFiles = useCallback(
+    (userId, params) => api.getUserFiles(userId, token, params),
+    [token]
+  );
+
   const closeStaffModal = () => {
     setIsStaffModalOpen(false);
     setEditingStaff(null);
@@ -625,7 +751,7 @@ function useUserDashboardState(token, currentUser) {
     _executeSaveStaff(
       formData, token, editingStaff, 
       setStaffModalMessage, closeStaffModal, 
-      resetFiltersAndFetch, fetchUsers
+      resetFiltersAndFetch, refreshUnlessLive
     );
   };
   
@@ -634,7 +760,7 @@ function useUserDashboardState(token, currentUser) {
     _executeSaveUser({
       formData, profilePicFile, token, editingUser,
       setUserModalError, closeUserModal,
-      resetFiltersAndFetch, fetchUsers
+      resetFiltersAndFetch, fetchUsers: refreshUnlessLive
     });
   };
 
@@ -642,7 +768,7 @@ function useUserDashboardState(token, currentUser) {
     if (window.confirm('Are you sure you want to delete this user? This will also delete all their uploaded files and profile picture.')) {
       try {
         await api.deleteUser(id, token);
-        fetchUsers();
+        refreshUnlessLive();
       } catch (err) {
         alert(`Error deleting user: ${err.message}`);
       }
@@ -680,7 +806,7 @@ function useUserDashboardState(token, currentUser) {
     try {
       setLoading(true);
       await api.adminAddFile(currentUserIdForUpload, formData, token);
-      await fetchUsers();
+      refreshUnlessLive();
     } catch (err) {
       setFileManagementError(`Failed to upload file: ${err.message}`);
     } finally {
@@ -696,7 +822,7 @@ function useUserDashboardState(token, currentUser) {
       try {
         setLoading(true);
         await api.adminDeleteFile(fileId, token);
-        await fetchUsers();
+        refreshUnlessLive();
       } catch (err) {
         setFileManagementError(`Failed to delete file: ${err.message}`);
       } finally {
@@ -735,10 +861,10 @@ function useUserDashboardState(token, currentUser) {
 
     // Handlers
     handleSort, handleRoleChange, handleAccountTypeChange, handleSensitivityChange,
-    handleClearFilters, handleDownload, handleSaveStaff, handleSaveUser,
+    handleClearFilters, handleDownload, handleDownloadAll, handleSaveStaff, handleSaveUser,
     handleDeleteUser, handleCreateStaff, closeStaffModal, closeUserModal,
     handleRowClick, handleAdminFileAddClick, handleAdminFileUpload,
-    handleAdminFileDelete, handleEditClick
+    handleAdminFileDelete, handleEditClick, loadUserFiles
   };
 }
 
@@ -855,7 +981,7 @@ SearchFilterBar.propTypes = {
 // --- FIX: Extracted helper to remove nested ternary ---
 function renderTableBody(
   loading, error, isAdmin, users, expandedRowId, fileManagementError,
-  onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onFileDelete
+  onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onDownloadAll, onFileDelete, onLoadFiles
 ) {
   if (loading) {
     return (
@@ -880,15 +1006,17 @@ function renderTableBody(
       fileManagementError={fileManagementError}
       onFileAddClick={onFileAddClick}
       onFileDownload={onFileDownload}
+      onDownloadAll={onDownloadAll}
       onFileDelete={onFileDelete}
+      onLoadFiles={onLoadFiles}
     />
   ));
 }
 
 function UserTable({ 
   loading, error, isAdmin, users, expandedRowId, fileManagementError,
-  onSort, onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onFileDelete,
-  sortBy, sortOrder 
+  onSort, onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onDownloadAll, onFileDelete,
+  onLoadFiles, sortBy, sortOrder 
 }) {
   return (
     <div className="overflow-x-auto bg-white dark:bg-gray-800 rounded-lg shadow">
@@ -924,7 +1052,7 @@ function UserTable({
           {/* --- FIX: Use helper function --- */}
           {renderTableBody(
             loading, error, isAdmin, users, expandedRowId, fileManagementError,
-            onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onFileDelete
+            onRowClick, onEditClick, onDeleteClick, onFileAddClick, onFileDownload, onDownloadAll, onFileDelete, onLoadFiles
           )}
         </tbody>
       </table>
@@ -946,7 +1074,9 @@ UserTable.propTypes = {
   onDeleteClick: PropTypes.func.isRequired,
   onFileAddClick: PropTypes.func.isRequired,
   onFileDownload: PropTypes.func.isRequired,
+  onDownloadAll: PropTypes.func.isRequired,
   onFileDelete: PropTypes.func.isRequired,
+  onLoadFiles: PropTypes.func.isRequired,
   sortBy: PropTypes.string.isRequired,
   sortOrder: PropTypes.string.isRequired,
 };
@@ -1046,10 +1176,10 @@ export function UserDashboard({ token, onLogout, currentUser }) {
 
     // Handlers
     handleSort, handleRoleChange, handleAccountTypeChange, handleSensitivityChange,
-    handleClearFilters, handleDownload, handleSaveStaff, handleSaveUser,
+    handleClearFilters, handleDownload, handleDownloadAll, handleSaveStaff, handleSaveUser,
     handleDeleteUser, handleCreateStaff, closeStaffModal, closeUserModal,
     handleRowClick, handleAdminFileAddClick, handleAdminFileUpload,
-    handleAdminFileDelete, handleEditClick
+    handleAdminFileDelete, handleEditClick, loadUserFiles
   } = useUserDashboardState(token, currentUser);
 
   // --- This is now the *entire* render block ---
@@ -1111,7 +1241,9 @@ export function UserDashboard({ token, onLogout, currentUser }) {
         onDeleteClick={handleDeleteUser}
         onFileAddClick={handleAdminFileAddClick}
         onFileDownload={handleDownload}
+        onDownloadAll={handleDownloadAll}
         onFileDelete={handleAdminFileDelete}
+        onLoadFiles={loadUserFiles}
         sortBy={sortBy}
         sortOrder={sortOrder}
       />